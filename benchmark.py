@@ -0,0 +1,466 @@
+"""
+Benchmarks de las partes más costosas de scrap_html_to_pdf sin acceder a la
+documentación real: las páginas se generan de forma sintética y, para las
+etapas completas, se sirven desde un sitio de documentación local.
+
+Los resultados se añaden a benchmark_results.jsonl junto con el commit actual
+para poder compararlos entre versiones (--compare).
+
+Uso:
+    python benchmark.py [--suite micro|site|all] [--pages N] [--tables N] [--code-blocks N]
+                        [--curls N] [--repeat N] [--large-sizes N ...] [--order-sizes N ...]
+                        [--results RUTA] [--compare]
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from bs4 import BeautifulSoup
+from PyPDF2 import PageObject, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+import scrap_html_to_pdf as scraper
+
+BENCH_URL = "https://example.com/doc/bench/page.html"
+RESULTS_FILE = "benchmark_results.jsonl"
+SITE_SECTIONS = ["common", "market", "trade", "account"]
+
+results = {}
+
+def build_page(tables=50, code_blocks=50, curls=10, nav_links=None):
+    """
+    Genera una página de documentación con tablas de parámetros, bloques de
+    código, ejemplos JSON y ejemplos curl duplicados.
+    """
+    nav = "".join(f"<a href='{href}'>{href}</a>" for href in nav_links or ["a.html"])
+    parts = ["<html><head><title>Bench</title></head><body>",
+             f"<header>Cabecera</header><nav>{nav}</nav>"]
+
+    for i in range(tables):
+        rows = "".join(f"<tr><td>param{j}</td><td>string</td><td>Descripción {j}</td></tr>" for j in range(10))
+        parts.append(
+            f"<h3>Parámetros {i}</h3>"
+            f"<div class='params'><table><tr><th>Nombre</th><th>Tipo</th><th>Descripción</th></tr>{rows}</table></div>"
+        )
+
+    for i in range(code_blocks):
+        parts.append(
+            f"<p>Request example</p><pre>{{\"id\": {i}, \"items\": [1, 2, 3]}}</pre>"
+            f"<pre>{{\"id\": {i}, \"items\": [1, 2, 3]}}</pre>"
+            f"<div class='code-block'><code>const value{i} = await client.get('/api/v1/{i}');</code></div>"
+        )
+
+    for i in range(curls):
+        curl = f"curl-X'GET' --url 'https://example.com/api/{i}' -H 'api-key: demo'"
+        parts.append(f"<div class='curl-example'><span>{curl}</span></div>" * 2)
+
+    parts.append("<img src='logo.png'><script>var x = 1;</script></body></html>")
+    return "".join(parts)
+
+def time_call(func, repeat):
+    """
+    Ejecuta la función `repeat` veces y devuelve la duración de cada ejecución.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def report(name, durations):
+    results[name] = {
+        "median_ms": round(statistics.median(durations) * 1000, 3),
+        "min_ms": round(min(durations) * 1000, 3),
+        "runs": len(durations),
+    }
+    print(f"{name:<36} mediana {statistics.median(durations) * 1000:8.2f} ms  "
+          f"mín {min(durations) * 1000:8.2f} ms  ({len(durations)} ejecuciones)")
+
+def bench_process_content_containers(html, repeat):
+    # El análisis del HTML se excluye de la medición
+    soups = [BeautifulSoup(html, "html.parser") for _ in range(repeat)]
+    durations = []
+    for soup in soups:
+        start = time.perf_counter()
+        scraper.process_content_containers(soup)
+        durations.append(time.perf_counter() - start)
+    report("process_content_containers", durations)
+
+def bench_large_pages(sizes, repeat):
+    """
+    Mide process_content_containers con páginas cada vez más grandes para
+    comprobar que el coste crece de forma lineal con el tamaño de la página.
+    """
+    for size in sizes:
+        html = build_page(tables=size, code_blocks=size, curls=size // 10)
+        soups = [BeautifulSoup(html, "html.parser") for _ in range(repeat)]
+        durations = []
+        for soup in soups:
+            start = time.perf_counter()
+            scraper.process_content_containers(soup)
+            durations.append(time.perf_counter() - start)
+        report(f"página grande ({size} tablas)", durations)
+
+def bench_link_extraction(html, repeat):
+    content = html.encode("utf-8")
+    report("enlaces con BeautifulSoup", time_call(
+        lambda: BeautifulSoup(content, "html.parser").find_all("a", href=True), repeat))
+    report("extract_links", time_call(lambda: scraper.extract_links(content), repeat))
+
+def bench_process_html(html, repeat):
+    # BENCH_URL no existe: los recursos no se descargan
+    scraper.ASSET_CACHE_ENABLED = False
+    scraper.page_store.put(BENCH_URL, html.encode("utf-8"))
+    report(f"process_html [{scraper.PARSER_BACKEND}]", time_call(lambda: scraper.process_html(BENCH_URL), repeat))
+
+def build_url_set(count):
+    """
+    Genera `count` URLs repartidas entre las secciones, subsecciones y archivos
+    con orden específico de la configuración del scraper.
+    """
+    base = scraper.BASE_DOMAIN
+    folders = list(scraper.SECTION_ORDER) + ["other"]
+    for section, subsections in scraper.SUBSECTION_ORDER.items():
+        folders += [f"{section}/{subsection}" for subsection in subsections]
+    pinned = [f"{group}/{name}" for group, names in scraper.SPECIFIC_FILE_ORDER.items() for name in names]
+    
+    urls = [base + quote(path) for path in pinned]
+    for i in range(count - len(urls)):
+        urls.append(f"{base}{folders[i % len(folders)]}/page{i}.html")
+    return sorted(urls)
+
+def bench_url_ordering(sizes, repeat):
+    """
+    Mide la ordenación del documento con la configuración actual y con una
+    URL de cada cien fijada en REFERENCE_ORDER.
+    """
+    reference_order = scraper.REFERENCE_ORDER
+    try:
+        for size in sizes:
+            urls = build_url_set(size)
+            scraper.REFERENCE_ORDER = reference_order
+            report(f"order_document_urls ({size} URLs)", time_call(lambda: scraper.order_document_urls(urls), repeat))
+            scraper.REFERENCE_ORDER = urls[::100]
+            report(f"  con {len(scraper.REFERENCE_ORDER)} referencias",
+                   time_call(lambda: scraper.order_document_urls(urls), repeat))
+    finally:
+        scraper.REFERENCE_ORDER = reference_order
+
+def build_site(root, pages, tables, code_blocks, curls):
+    """
+    Genera un sitio de documentación en `root`/doc, repartido en secciones, en el
+    que cada página enlaza con sus vecinas. Devuelve las rutas de las páginas.
+    """
+    paths = [f"doc/{SITE_SECTIONS[i % len(SITE_SECTIONS)]}/page{i}.html" for i in range(pages)]
+    for section in SITE_SECTIONS:
+        os.makedirs(os.path.join(root, "doc", section), exist_ok=True)
+        with open(os.path.join(root, "doc", section, "logo.png"), "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + section.encode("utf-8"))
+    for i, path in enumerate(paths):
+        nav_links = ["/" + other for other in paths[max(0, i - 2):i + 3]]
+        os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(root, path), "w", encoding="utf-8") as f:
+            f.write(build_page(tables, code_blocks, curls, nav_links))
+    return paths
+
+def serve_site(root):
+    """
+    Sirve el sitio de `root` en un puerto libre de localhost, en un hilo aparte.
+    Las respuestas llevan un ETag y las peticiones con un If-None-Match que
+    coincide reciben un 304; `server.if_none_match` guarda los ETag recibidos.
+    """
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+        
+        def send_head(self):
+            path = self.translate_path(self.path)
+            self.etag = None
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+                received = self.headers.get("If-None-Match")
+                if received:
+                    self.server.if_none_match.append(received)
+                if received == self.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return None
+            return super().send_head()
+        
+        def end_headers(self):
+            if getattr(self, "etag", None):
+                self.send_header("ETag", self.etag)
+            super().end_headers()
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=root))
+    server.if_none_match = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_fixture_pdfs(root, count, pages_per_file=3):
+    """
+    Genera `count` PDFs de prueba en `root` para medir merge_pdfs sin backend de
+    renderizado. Cada página tiene texto propio, y todos los PDFs usan la misma
+    fuente y la misma imagen, como los fragmentos de una misma documentación,
+    para que la deduplicación tenga recursos repetidos que combinar.
+    """
+    os.makedirs(root, exist_ok=True)
+    pixels = bytes((x * y) % 256 for y in range(64) for x in range(64))
+    pdf_files = []
+    for i in range(count):
+        writer = PdfWriter()
+        font = writer._add_object(DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }))
+        image = DecodedStreamObject()
+        image.set_data(pixels)
+        image.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(64),
+            NameObject("/Height"): NumberObject(64),
+            NameObject("/ColorSpace"): NameObject("/DeviceGray"),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+        })
+        image = writer._add_object(image)
+        for page_number in range(pages_per_file):
+            page = PageObject.create_blank_page(width=595, height=842)
+            content = DecodedStreamObject()
+            content.set_data(f"q 64 0 0 64 72 700 cm /Im1 Do Q "
+                             f"BT /F1 12 Tf 72 650 Td (Fragmento {i}, pagina {page_number}) Tj ET".encode("ascii"))
+            page[NameObject("/Contents")] = writer._add_object(content)
+            page[NameObject("/Resources")] = DictionaryObject({
+                NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+                NameObject("/XObject"): DictionaryObject({NameObject("/Im1"): image}),
+            })
+            writer.add_page(page)
+        path = os.path.join(root, f"fixture_{i}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        pdf_files.append(path)
+    return pdf_files
+
+def renderer_available(name):
+    if name == "weasyprint":
+        return scraper.load_weasyprint() is not None
+    command = scraper.config.wkhtmltopdf if scraper.config else shutil.which("wkhtmltopdf")
+    return bool(command) and os.path.exists(command)
+
+def check_render(name, urls, pdf_files):
+    """
+    Comprueba que un backend ha generado un PDF legible y con páginas por cada URL,
+    para no comparar tiempos de un renderizado que ha fallado.
+    """
+    problems = [] if len(pdf_files) == len(urls) else [f"{len(pdf_files)} PDFs para {len(urls)} páginas"]
+    for path in pdf_files:
+        try:
+            if not len(scraper.PdfReader(path).pages):
+                problems.append(f"{path} no tiene páginas")
+        except Exception as e:
+            problems.append(f"{path} no es un PDF válido: {str(e)}")
+    if problems:
+        print(f"Aviso: convert_to_pdf [{name}] no es válido: " + "; ".join(problems[:5]))
+    else:
+        print(f"convert_to_pdf [{name}]: {len(pdf_files)} PDFs válidos")
+
+def check_http_cache(server, url, cache_dir):
+    """
+    Comprueba contra el sitio local que HttpCache revalida las páginas guardadas:
+    la segunda descarga debe enviar el If-None-Match y servirse desde la caché
+    con la respuesta 304.
+    """
+    cache = scraper.HttpCache(cache_dir)
+    first, _ = cache.fetch(url)
+    server.if_none_match.clear()
+    second, ok = cache.fetch(url)
+    
+    problems = []
+    if not server.if_none_match:
+        problems.append("la segunda petición no envió If-None-Match")
+    if cache.stats["revalidated"] != 1:
+        problems.append("la segunda descarga no se sirvió desde la caché con un 304")
+    if not ok or second != first:
+        problems.append("el contenido revalidado no coincide con el descargado")
+    if problems:
+        print("Aviso: la caché HTTP no es válida: " + "; ".join(problems))
+    else:
+        print("Caché HTTP: la segunda descarga se revalidó con If-None-Match (304)")
+
+def bench_site(pages, tables, code_blocks, curls, repeat):
+    """
+    Mide las etapas completas del scraper contra el sitio local: crawling,
+    process_html, process_content_containers, convert_to_pdf (con cada backend
+    de renderizado disponible) y merge_pdfs.
+    Sin ningún backend disponible, merge_pdfs se mide con PDFs de prueba.
+    Las cachés HTTP y de renderizado se desactivan para medir el trabajo real.
+    """
+    root = tempfile.mkdtemp(prefix="bench_site_")
+    server = None
+    try:
+        paths = build_site(root, pages, tables, code_blocks, curls)
+        server = serve_site(root)
+        base = f"http://127.0.0.1:{server.server_port}/"
+        print(f"Sitio local: {len(paths)} páginas en {base}doc/")
+        
+        scraper.BASE_DOMAIN = base + "doc/"
+        scraper.TEMP_DIR = os.path.join(root, "temp_pdfs")
+        scraper.HTTP_CACHE_ENABLED = False
+        scraper.INCREMENTAL_RENDER = False
+        scraper.ASSET_CACHE_ENABLED = True
+        scraper.asset_cache = scraper.AssetCache(os.path.join(root, "assets"))
+        scraper.run_journal.path = os.path.join(root, "run_journal.jsonl")
+        os.makedirs(scraper.TEMP_DIR, exist_ok=True)
+        
+        def crawl():
+            scraper.page_store.clear()
+            return scraper.extract_urls_by_crawling(base + paths[0])
+        
+        check_http_cache(server, base + paths[0], os.path.join(root, "http_cache"))
+        report("extract_urls_by_crawling", time_call(crawl, repeat))
+        urls = crawl()
+        if len(urls) != len(paths):
+            print(f"Aviso: el crawling encontró {len(urls)} de {len(paths)} páginas")
+        
+        # Las páginas ya están en el almacén: se mide solo el procesamiento
+        report("process_html (sitio)", time_call(lambda: [scraper.process_html(url) for url in urls], repeat))
+        
+        contents = [scraper.fetch_page(url) for url in urls]
+        soups = [[scraper.make_soup(content) for content in contents] for _ in range(repeat)]
+        durations = []
+        for batch in soups:
+            start = time.perf_counter()
+            for soup in batch:
+                scraper.process_content_containers(soup)
+            durations.append(time.perf_counter() - start)
+        report("process_content_containers (sitio)", durations)
+        
+        renderers = [name for name in scraper.RENDERERS if renderer_available(name)]
+        for name in scraper.RENDERERS:
+            if name not in renderers:
+                print(f"{name} no está disponible: no se mide convert_to_pdf [{name}]")
+        
+        # Todos los backends renderizan las mismas páginas (el arranque de sus procesos
+        # se incluye en la medición); merge_pdfs combina los PDFs del último
+        pdf_files = []
+        for name in renderers:
+            scraper.RENDER_BACKEND = name
+            def convert():
+                # El diario daría por convertidas las páginas de la medición anterior
+                scraper.run_journal.reset()
+                pdf_files[:] = scraper.convert_to_pdf(urls)
+            report(f"convert_to_pdf [{name}]", time_call(convert, 1))
+            check_render(name, urls, pdf_files)
+        scraper.close_renderer()
+        scraper.RENDER_BACKEND = "wkhtmltopdf"
+        if not pdf_files:
+            print("merge_pdfs se mide con PDFs de prueba")
+            pdf_files = build_fixture_pdfs(os.path.join(root, "fixtures"), len(urls))
+        
+        output = os.path.join(root, "merged.pdf")
+        sizes = {}
+        for dedup in (False, True):
+            scraper.MERGE_DEDUP = dedup
+            name = "merge_pdfs" if dedup else "merge_pdfs [sin dedup]"
+            report(name, time_call(lambda: scraper.merge_pdfs(pdf_files, output), repeat))
+            sizes[name] = os.path.getsize(output)
+        print("Tamaño del PDF combinado: " + ", ".join(f"{name} {size / 1024:.1f} KB" for name, size in sizes.items()))
+    
+    finally:
+        if server:
+            server.shutdown()
+        scraper.page_store.clear()
+        shutil.rmtree(root, ignore_errors=True)
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def store_results(path, params):
+    """
+    Añade los resultados de esta ejecución al histórico y devuelve la ejecución
+    anterior con los mismos parámetros, si existe.
+    """
+    previous = None
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry.get("params") == params:
+                    previous = entry
+    
+    entry = {
+        "commit": current_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return previous
+
+def compare_results(previous):
+    print(f"Comparación con {previous.get('commit')} ({previous.get('date')}):")
+    for name, current in results.items():
+        before = previous["results"].get(name)
+        if not before or not before["median_ms"]:
+            continue
+        change = (current["median_ms"] - before["median_ms"]) / before["median_ms"] * 100
+        print(f"{name:<36} {before['median_ms']:10.2f} ms -> {current['median_ms']:10.2f} ms  ({change:+.1f}%)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks de scrap_html_to_pdf")
+    parser.add_argument("--suite", choices=["micro", "site", "all"], default="all",
+                        help="Benchmarks de funciones aisladas, del sitio local completo o ambos")
+    parser.add_argument("--pages", type=int, default=40, help="Páginas del sitio local")
+    parser.add_argument("--tables", type=int, default=50, help="Tablas de parámetros por página")
+    parser.add_argument("--code-blocks", type=int, default=50, help="Bloques de código por página")
+    parser.add_argument("--curls", type=int, default=10, help="Ejemplos curl (duplicados) por página")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones de cada medición")
+    parser.add_argument("--large-sizes", type=int, nargs="*", default=[100, 200, 400],
+                        help="Número de tablas y bloques de código de las páginas grandes")
+    parser.add_argument("--order-sizes", type=int, nargs="*", default=[10000, 100000],
+                        help="Número de URLs para medir la ordenación del documento")
+    parser.add_argument("--results", default=RESULTS_FILE, help="Histórico de resultados (JSON Lines)")
+    parser.add_argument("--compare", action="store_true",
+                        help="Comparar con la ejecución anterior con los mismos parámetros")
+    args = parser.parse_args()
+
+    if args.suite in ("micro", "all"):
+        html = build_page(args.tables, args.code_blocks, args.curls)
+        print(f"Página sintética: {len(html) / 1024:.1f} KB")
+        bench_process_content_containers(html, args.repeat)
+        bench_large_pages(args.large_sizes, args.repeat)
+        bench_link_extraction(html, args.repeat)
+        bench_url_ordering(args.order_sizes, args.repeat)
+        for backend in ("html.parser", "lxml"):
+            scraper.PARSER_BACKEND = backend
+            print(f"Analizador: {backend}")
+            bench_process_html(html, args.repeat)
+        scraper.PARSER_BACKEND = "html.parser"
+
+    if args.suite in ("site", "all"):
+        # El scraper registra cada página; aquí solo interesan los avisos
+        logging.getLogger().setLevel(logging.WARNING)
+        bench_site(args.pages, args.tables // 5, args.code_blocks // 5, args.curls // 5, args.repeat)
+
+    params = {key: value for key, value in vars(args).items() if key not in ("results", "compare")}
+    previous = store_results(args.results, params)
+    if args.compare and previous:
+        compare_results(previous)
@@ -1,12 +1,57 @@
 import os
+import sys
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, NavigableString, Tag
+import soupsieve
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, urlunparse, quote, unquote, parse_qsl, urlencode
+from collections import deque
 import pdfkit
-from PyPDF2 import PdfMerger
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import yaml
+except ImportError:
+    yaml = None
+from PyPDF2 import PdfMerger, PdfReader
+from PyPDF2.generic import (
+    ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject
+)
 import re
 import logging
 import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+import functools
+import itertools
+import queue
+import shutil
+import math
+import contextlib
+import pathlib
+import random
+import gzip
+import io
+import zlib
+import importlib
+import importlib.util
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Configuración de logs
 logging.basicConfig(
@@ -16,9 +61,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Configuración de wkhtmltopdf (¡AJUSTAR ESTA RUTA!)
-WKHTMLTOPDF_PATH = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'  # Windows
+# También puede indicarse con la variable de entorno WKHTMLTOPDF_PATH
+WKHTMLTOPDF_PATH = os.environ.get("WKHTMLTOPDF_PATH", r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe')  # Windows
 # WKHTMLTOPDF_PATH = '/usr/local/bin/wkhtmltopdf'  # Linux/Mac
-config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+try:
+    config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+except OSError:
+    # Sin la ruta configurada, pdfkit buscará wkhtmltopdf en el PATH al renderizar
+    logger.warning(f"No se encontró wkhtmltopdf en {WKHTMLTOPDF_PATH}; se usará el del PATH")
+    config = None
 
 # Configuración general
 SEED_URL = "https://openapidoc.bitunix.com/doc/common/introduction.html"
@@ -58,114 +109,1326 @@ SPECIFIC_FILE_ORDER = {
     "websocket/public": ["Trade Channel.html"]  # Asegura que "Trade Channel.html" sea el último
 }
 
+# Descubrimiento de URLs: "crawl" (recorrido completo), "sitemap" (sitemap.xml),
+# "nav" (menú de la página inicial) o "auto" (sitemap, después menú y, si fallan, crawling)
+DISCOVERY_MODE = "crawl"
+SITEMAP_URLS = []  # Sitemaps a leer; vacío = /sitemap.xml del host y de BASE_DOMAIN
+DISCOVERY_CRAWL_MISSING = False  # Completar el sitemap o el menú con un crawling
+DISCOVERY_MIN_URLS = 5  # Con menos URLs se considera que la fuente no sirve
+
+# Modo batch: varios sitios en una sola ejecución (--batch trabajos.yaml)
+BATCH_PARALLEL_SITES = 4  # Sitios que se procesan a la vez
+BATCH_HOST_CONNECTIONS = 4  # Descargas simultáneas como máximo por host, entre todos los sitios
+
+# Configuración del crawling concurrente
+CRAWL_WORKERS = 8  # Número de páginas descargadas en paralelo durante el crawling
+CRAWL_RATE_LIMIT = 0  # Máximo de peticiones por segundo a un mismo host (0 = sin límite)
+CRAWL_MAX_DEPTH = 0  # Profundidad máxima de enlaces desde la página inicial (0 = sin límite)
+CRAWL_MAX_PAGES = 0  # Número máximo de URLs a descubrir (0 = sin límite)
+
+# Límite de memoria del almacén de páginas; a partir de él las páginas se vuelcan a disco
+PAGE_STORE_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Peticiones HTTP: sesión compartida con conexiones persistentes y reintentos
+HTTP_TIMEOUT = 10  # Segundos por petición
+HTTP_RETRIES = 3  # Reintentos ante errores de conexión, 429 y 5xx
+HTTP_BACKOFF = 0.5  # Espera base en segundos; se duplica en cada reintento (con jitter)
+HTTP_BACKOFF_MAX = 60  # Espera máxima entre reintentos, también para Retry-After
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Caché HTTP persistente entre ejecuciones (revalidada con ETag / Last-Modified)
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_DIR = "http_cache"
+
+# Imágenes, hojas de estilo y fuentes se descargan una sola vez a una caché local
+# direccionada por contenido; las páginas referencian las copias locales
+ASSET_CACHE_ENABLED = True
+ASSET_CACHE_DIR = "asset_cache"
+INLINE_STYLESHEETS = True  # Incrustar las hojas de estilo en la página como <style>
+
+# Renderizado incremental: los PDFs por página se guardan en una caché persistente
+INCREMENTAL_RENDER = True
+RENDER_CACHE_DIR = "render_cache"
+
+# Renderizado en paralelo: cada trabajo lanza su propio proceso de wkhtmltopdf
+RENDER_WORKERS = os.cpu_count() or 1
+RENDER_TIMEOUT = 120  # Segundos máximos por página antes de abortar wkhtmltopdf
+RENDER_RETRIES = 2  # Reintentos cuando el proceso de wkhtmltopdf falla o se cuelga
+
+# Backend de renderizado: "wkhtmltopdf" (un proceso por página) o "weasyprint"
+# (procesos de WeasyPrint que se arrancan una vez y renderizan todas las páginas)
+RENDER_BACKEND = "wkhtmltopdf"
+
+# Perfil de renderizado: "print", "fast", "draft", "text" o "auto" (elige por página)
+RENDER_PROFILE = "auto"
+# Cambios de cada perfil sobre las opciones de build_pdf_options (None = quitar la opción).
+# Los <script> se eliminan al procesar la página, así que normalmente no hace falta
+# esperar a JavaScript; los dpi altos solo afectan a las imágenes.
+RENDER_PROFILES = {
+    "print": {},
+    "fast": {"javascript-delay": None, "disable-javascript": ""},
+    "draft": {"javascript-delay": None, "disable-javascript": "", "dpi": "96",
+              "lowquality": "", "image-quality": "60"},
+    "text": {"javascript-delay": None, "disable-javascript": "", "dpi": "96"},
+}
+
+# Analizador HTML usado para construir el árbol de cada página ("html.parser" o "lxml")
+PARSER_BACKEND = "html.parser"
+
+# Modo de combinación: "merger" (PdfMerger al final) o "stream" (escritura incremental)
+MERGE_MODE = "merger"
+MERGE_DEDUP = True  # Escribir una sola vez las fuentes e imágenes repetidas entre fragmentos
+MERGE_RECOMPRESS = False  # Recomprimir los streams con el nivel máximo de zlib
+
+# Modo de renderizado: "pages" (un wkhtmltopdf por página) o "document" (todo el
+# sitio concatenado en un único HTML, o en lotes de RENDER_BATCH_SIZE páginas)
+RENDER_MODE = "pages"
+RENDER_BATCH_SIZE = 0  # Páginas por lote en modo documento (0 = un único lote)
+RENDER_TOC = False  # Generar un índice al principio en modo documento
+
+# Modo pipeline: crawling, procesamiento y renderizado a la vez, unidos por colas acotadas
+PIPELINE_MODE = False
+PIPELINE_QUEUE_SIZE = 32  # Páginas en espera como máximo entre dos etapas
+PIPELINE_PROCESS_WORKERS = 2  # Hilos que limpian el HTML de las páginas
+
+# Modo de memoria acotada: los árboles se liberan en cuanto se serializan y el HTML
+# pendiente de renderizar espera en archivos temporales, que wkhtmltopdf lee del disco
+MEMORY_BOUNDED = False
+
+# Páginas casi duplicadas (variantes, copias versionadas, índices que repiten a sus
+# hijas): "off" no hace nada, "skip" no las renderiza y "collapse" deja solo una
+# nota con un enlace a la original
+DUPLICATE_MODE = "off"
+DUPLICATE_MAX_DISTANCE = 7  # Bits distintos como máximo entre simhashes de 64 bits
+DUPLICATE_MIN_WORDS = 50  # Páginas más cortas no se comparan, para evitar falsos positivos
+
+# Diario de la ejecución para poder reanudarla con --resume si se interrumpe
+JOURNAL_PATH = "run_journal.jsonl"
+RESUME = False
+
+# Informe JSON con los tiempos de cada etapa al final de la ejecución ("" = desactivado)
+RUN_REPORT_PATH = "run_report.json"
+RUN_REPORT_SLOWEST = 10  # Número de páginas más lentas que se incluyen en el informe
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
-def extract_urls_ordered(seed_url):
+def peak_rss():
     """
-    Extrae URLs siguiendo el orden del menú de navegación del sitio.
+    Memoria residente máxima en MB de este proceso y de los procesos hijos ya
+    terminados (wkhtmltopdf), o None si no se puede medir en este sistema.
     """
-    logger.info(f"Accediendo a la página principal: {seed_url}")
+    if resource:
+        # ru_maxrss está en bytes en macOS y en KB en Linux
+        scale = 1 if sys.platform == "darwin" else 1024
+        return {
+            "self_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 1),
+            "children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20, 1),
+        }
     
     try:
-        # Obtenemos la página principal que contiene el menú completo
-        response = requests.get(seed_url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(response.content, "html.parser")
+        import ctypes
+        from ctypes import wintypes
         
-        # Buscar el menú de navegación principal
-        menu = soup.find("nav") or soup.find("div", class_="menu")
-        if not menu:
-            # Intentar encontrar otros elementos que puedan contener el menú
-            menu = soup.find("aside") or soup.find("div", class_="sidebar")
-            if not menu:
-                menu = soup  # Si no encontramos un menú específico, usamos toda la página
-        
-        # Buscar todos los enlaces en la estructura del menú
-        ordered_urls = []
-        menu_items = []
-        
-        # 1. Intentar encontrar elementos de lista que suelen representar menús
-        menu_lists = menu.find_all(["ul", "ol"])
-        if menu_lists:
-            for menu_list in menu_lists:
-                menu_items.extend(menu_list.find_all("li"))
-        
-        # 2. Si no hay elementos de lista, buscar directamente los enlaces
-        if not menu_items:
-            menu_items = menu.find_all("a", href=True)
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+        
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return {"self_mb": round(counters.PeakWorkingSetSize / 2 ** 20, 1), "children_mb": None}
+    except (AttributeError, OSError):
+        return None
+
+class RunStats:
+    """
+    Registra la duración de cada etapa (descarga, análisis, limpieza, renderizado,
+    combinación) por URL, junto con los bytes descargados y el tamaño de los PDFs,
+    y genera un informe con percentiles por etapa y las páginas más lentas.
+    """
+    # Etapas que no se solapan entre sí y suman el tiempo total de una página
+    # (parse y process_content_containers ya están dentro de process_html; las
+    # descargas de recursos se miden aparte, en "asset", por URL del recurso)
+    PAGE_STAGES = ("fetch", "link_extraction", "process_html", "render")
+    # Descargas: su tiempo se descuenta de las etapas dentro de las que ocurren
+    NETWORK_STAGES = ("fetch", "asset", "asset_wait")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.samples = []
+        self.notes = {}
+        self.started = time.time()
+
+    def note(self, name, value):
+        """
+        Añade al informe un dato de la ejecución que no es una medida de tiempo.
+        """
+        with self.lock:
+            self.notes[name] = value
+
+    def record(self, stage, seconds, url=None, **extra):
+        sample = dict(extra, stage=stage, seconds=seconds, url=url)
+        with self.lock:
+            self.samples.append(sample)
+
+    @contextlib.contextmanager
+    def measure(self, stage, url=None):
+        """
+        Mide el bloque como una muestra de la etapa. Se puede añadir información
+        (por ejemplo, bytes) al diccionario que devuelve. Las descargas medidas
+        dentro del bloque (NETWORK_STAGES) no cuentan en él: son sus propias muestras.
+        """
+        network = self.local.__dict__.setdefault("network", [])
+        network.append(0.0)
+        extra = {}
+        start = time.perf_counter()
+        try:
+            yield extra
+        except Exception:
+            extra["error"] = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = network.pop()
+            if network:
+                network[-1] += elapsed if stage in self.NETWORK_STAGES else nested
+            self.record(stage, elapsed - nested, url, **extra)
+
+    @staticmethod
+    def _percentile(values, percent):
+        # Percentil por rango más cercano sobre valores ya ordenados
+        return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+    def summary(self, slowest=None):
+        slowest = RUN_REPORT_SLOWEST if slowest is None else slowest
+        with self.lock:
+            samples = list(self.samples)
+        
+        stages = {}
+        for sample in samples:
+            stages.setdefault(sample["stage"], []).append(sample["seconds"])
+        
+        per_url = {}
+        for sample in samples:
+            if sample["url"]:
+                page = per_url.setdefault(sample["url"], {"url": sample["url"], "seconds": 0.0, "stages": {}})
+                if sample["stage"] in self.PAGE_STAGES:
+                    page["seconds"] += sample["seconds"]
+                page["stages"][sample["stage"]] = page["stages"].get(sample["stage"], 0.0) + sample["seconds"]
+        
+        wall_time = time.time() - self.started
+        bytes_downloaded = sum(sample.get("bytes", 0) for sample in samples if sample["stage"] == "fetch")
+        pages_rendered = sum(1 for sample in samples if sample["stage"] == "render" and not sample.get("error"))
+        profiles = {}
+        for sample in samples:
+            if sample["stage"] == "render" and sample.get("profile"):
+                profiles[sample["profile"]] = profiles.get(sample["profile"], 0) + 1
+        
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_time": round(wall_time, 3),
+            "bytes_downloaded": bytes_downloaded,
+            "pdf_bytes": sum(sample.get("output_bytes", 0) for sample in samples if sample["stage"] == "render"),
+            "render_profiles": profiles,
+            "peak_rss": peak_rss(),
+            "throughput": {
+                "pages_rendered_per_second": round(pages_rendered / wall_time, 3) if wall_time else 0,
+                "bytes_downloaded_per_second": round(bytes_downloaded / wall_time, 1) if wall_time else 0,
+            },
+            "stages": {
+                stage: {
+                    "count": len(values),
+                    "total": round(sum(values), 4),
+                    "p50": round(self._percentile(sorted(values), 50), 4),
+                    "p95": round(self._percentile(sorted(values), 95), 4),
+                    "max": round(max(values), 4),
+                }
+                for stage, values in stages.items()
+            },
+            "slowest_pages": sorted(per_url.values(), key=lambda page: page["seconds"], reverse=True)[:slowest],
+        }
+
+    def write_report(self, path, **extra):
+        report = dict(self.summary(), **self.notes, **extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Informe de la ejecución guardado en {path}")
+        return report
+
+run_stats = RunStats()
+
+class RunJournal:
+    """
+    Diario de la ejecución en formato JSON Lines al que solo se añaden líneas:
+    las URLs descubiertas con su orden y cada PDF terminado con su hash. Si la
+    ejecución se interrumpe, --resume lo lee para no repetir el crawling ni las
+    páginas ya convertidas.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.crawled_urls = None
+        self.urls = None
+        self.pages = {}
+        self.fingerprints = {}
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load(self):
+        self.crawled_urls = None
+        self.urls = None
+        self.pages = {}
+        self.fingerprints = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Línea a medias si el proceso murió mientras escribía
+                        continue
+                    if entry.get("type") == "urls":
+                        self.crawled_urls = entry["crawled"]
+                        self.urls = entry["ordered"]
+                    elif entry.get("type") == "page":
+                        self.pages[entry["name"]] = entry
+                    elif entry.get("type") == "fingerprint":
+                        self.fingerprints[entry["name"]] = entry["simhash"]
+        except OSError:
+            pass
+        return self
+
+    def reset(self):
+        with self.lock:
+            self.crawled_urls = None
+            self.urls = None
+            self.pages = {}
+            self.fingerprints = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _append(self, entry):
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if entry["type"] == "page":
+                self.pages[entry["name"]] = entry
+            elif entry["type"] == "fingerprint":
+                self.fingerprints[entry["name"]] = entry["simhash"]
+
+    def record_urls(self, crawled_urls, ordered_urls):
+        self.crawled_urls = list(crawled_urls)
+        self.urls = list(ordered_urls)
+        self._append({"type": "urls", "crawled": self.crawled_urls, "ordered": self.urls})
+
+    def record_page(self, name, pdf_file, cache_key=None):
+        self._append({"type": "page", "name": name, "pdf": pdf_file, "sha256": self.file_hash(pdf_file),
+                      "cache_key": cache_key})
+
+    def record_fingerprint(self, name, simhash):
+        self._append({"type": "fingerprint", "name": name, "simhash": simhash})
+
+    def completed(self, name):
+        """
+        Devuelve el PDF ya generado para `name` si sigue en disco sin cambios.
+        """
+        with self.lock:
+            entry = self.pages.get(name)
+        if entry and os.path.exists(entry["pdf"]) and self.file_hash(entry["pdf"]) == entry["sha256"]:
+            return entry["pdf"]
+        return None
+
+run_journal = RunJournal(JOURNAL_PATH)
+
+class PageStore:
+    """
+    Guarda el contenido de las páginas descargadas durante la ejecución para que
+    el crawling y la conversión no las pidan dos veces. Cuando se supera el límite
+    de memoria, las páginas nuevas se escriben en disco.
+    """
+    def __init__(self, memory_limit, spill_dir):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.lock = threading.Lock()
+        self.in_memory = {}
+        self.on_disk = {}
+        self.memory_used = 0
+
+    def get(self, url):
+        with self.lock:
+            if url in self.in_memory:
+                return self.in_memory[url]
+            path = self.on_disk.get(url)
+        
+        if path:
+            with open(path, "rb") as f:
+                return f.read()
+        return None
+
+    def put(self, url, content):
+        with self.lock:
+            if url in self.in_memory or url in self.on_disk:
+                return
+            if self.memory_used + len(content) <= self.memory_limit:
+                self.in_memory[url] = content
+                self.memory_used += len(content)
+                return
+        
+        # Sin espacio en memoria: volcamos la página a disco
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".html")
+        with open(path, "wb") as f:
+            f.write(content)
+        with self.lock:
+            self.on_disk[url] = path
+
+    def clear(self):
+        with self.lock:
+            paths = list(self.on_disk.values())
+            self.in_memory.clear()
+            self.on_disk.clear()
+            self.memory_used = 0
+        
+        for path in paths:
+            os.remove(path)
+        if os.path.isdir(self.spill_dir):
+            os.rmdir(self.spill_dir)
+
+page_store = PageStore(PAGE_STORE_MEMORY_LIMIT, os.path.join(TEMP_DIR, "pages"))
+
+http_session = None
+http_session_lock = threading.Lock()
+
+def size_http_session(session, sites=1):
+    """
+    Dimensiona el pool de conexiones de la sesión según los hilos que pueden
+    descargar a la vez: los del crawling y los del procesado del pipeline, más
+    uno por cada sitio que se procesa en paralelo en modo batch (cada sitio
+    añade también su host al pool).
+    """
+    pool_size = CRAWL_WORKERS + PIPELINE_PROCESS_WORKERS + max(0, sites - 1)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+def get_http_session():
+    """
+    Devuelve la sesión HTTP compartida, creándola la primera vez.
+    """
+    global http_session
+    with http_session_lock:
+        if http_session is None:
+            http_session = requests.Session()
+            http_session.headers.update(HEADERS)
+            size_http_session(http_session)
+        return http_session
+
+def retry_delay(attempt, response=None):
+    """
+    Segundos de espera antes del reintento `attempt`: el indicado por Retry-After
+    si el servidor lo envía, o un backoff exponencial con jitter.
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), HTTP_BACKOFF_MAX)
+    
+    return random.uniform(0, min(HTTP_BACKOFF * 2 ** (attempt - 1), HTTP_BACKOFF_MAX))
+
+def http_get(url, headers=None):
+    """
+    Realiza una petición GET con las cabeceras comunes del scraper, reutilizando
+    las conexiones de la sesión compartida. Los errores de conexión, las
+    respuestas 429 y los 5xx se reintentan hasta HTTP_RETRIES veces.
+    """
+    session = get_http_session()
+    attempts = HTTP_RETRIES + 1
+    
+    for attempt in range(1, attempts + 1):
+        try:
+            response = session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == attempts:
+                raise
+            delay = retry_delay(attempt)
+            logger.warning(f"Error de conexión con {url} (intento {attempt}/{attempts}): {str(e)}")
         else:
-            # Si tenemos elementos de lista, extraer los enlaces de cada uno
-            menu_items = [item.find("a", href=True) for item in menu_items]
-            # Filtrar elementos None (li sin enlaces)
-            menu_items = [item for item in menu_items if item]
-        
-        logger.info(f"Elementos de menú encontrados: {len(menu_items)}")
-        
-        # Procesamos cada enlace en el orden del menú
-        for item in menu_items:
-            if hasattr(item, 'href') and item['href']:
-                href = item['href']
-                absolute_url = urljoin(seed_url, href)
+            if response.status_code not in HTTP_RETRY_STATUS or attempt == attempts:
+                return response
+            delay = retry_delay(attempt, response)
+            logger.warning(f"Respuesta {response.status_code} de {url} (intento {attempt}/{attempts}), "
+                           f"reintentando en {delay:.1f} s")
+        time.sleep(delay)
+
+class HttpCache:
+    """
+    Caché en disco de respuestas HTTP indexada por URL. Guarda el cuerpo junto con
+    sus validadores (ETag / Last-Modified) y los usa para hacer peticiones
+    condicionales: una respuesta 304 se sirve desde la caché.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "revalidated": 0, "unchanged": 0}
+        # Fecha de última modificación (lastmod del sitemap) por URL
+        self.lastmod = {}
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".body"), os.path.join(self.cache_dir, key + ".json")
+
+    def _count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    def _load(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def _store(self, url, response):
+        cache_control = response.headers.get("Cache-Control", "").lower()
+        if "no-store" in cache_control:
+            return
+        
+        max_age = 0
+        match = re.search(r"max-age=(\d+)", cache_control)
+        if match and "no-cache" not in cache_control:
+            max_age = int(match.group(1))
+        
+        meta = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires": time.time() + max_age,
+            "fetched": time.time(),
+        }
+        if not (meta["etag"] or meta["last_modified"] or max_age or url in self.lastmod):
+            return
+        
+        # Escribimos primero en ficheros temporales para no dejar entradas a medias
+        os.makedirs(self.cache_dir, exist_ok=True)
+        body_path, meta_path = self._paths(url)
+        suffix = f".{threading.get_ident()}.tmp"
+        with open(body_path + suffix, "wb") as f:
+            f.write(response.content)
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(body_path + suffix, body_path)
+        os.replace(meta_path + suffix, meta_path)
+
+    def _touch(self, url, meta):
+        # La copia sigue siendo válida: se actualiza la fecha de la última comprobación
+        _, meta_path = self._paths(url)
+        suffix = f".{threading.get_ident()}.tmp"
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, fetched=time.time()), f)
+        os.replace(meta_path + suffix, meta_path)
+
+    def fetch(self, url):
+        """
+        Devuelve (contenido, ok) para la URL, usando la caché siempre que sea posible.
+        """
+        meta, body = self._load(url)
+        
+        if meta and meta.get("expires", 0) > time.time():
+            self._count("hit")
+            return body, True
+        
+        # El sitemap indica que la página no ha cambiado desde que se guardó
+        lastmod = self.lastmod.get(url)
+        if meta and lastmod is not None and meta.get("fetched", 0) >= lastmod:
+            self._count("unchanged")
+            return body, True
+        
+        conditional = {}
+        if meta and meta.get("etag"):
+            conditional["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            conditional["If-Modified-Since"] = meta["last_modified"]
+        
+        response = http_get(url, conditional)
+        
+        if response.status_code == 304 and meta:
+            self._count("revalidated")
+            self._touch(url, meta)
+            return body, True
+        
+        self._count("miss")
+        if response.ok:
+            self._store(url, response)
+        return response.content, response.ok
+
+    def log_stats(self):
+        logger.info(
+            f"Caché HTTP: {self.stats['hit']} aciertos, "
+            f"{self.stats['revalidated']} revalidadas (304), "
+            f"{self.stats['unchanged']} sin cambios según el sitemap, "
+            f"{self.stats['miss']} descargas"
+        )
+
+http_cache = HttpCache(HTTP_CACHE_DIR)
+
+# Descargas en curso, para que dos hilos no pidan la misma página a la vez
+pending_fetches = {}
+pending_fetches_lock = threading.Lock()
+
+def fetch_url(url):
+    """
+    Descarga un recurso que no es una página (sitemaps, imágenes, CSS), a través
+    de la caché HTTP si está activada. Lanza IOError si la respuesta no es válida.
+    """
+    if HTTP_CACHE_ENABLED:
+        content, ok = http_cache.fetch(url)
+    else:
+        response = http_get(url)
+        content, ok = response.content, response.ok
+    if not ok:
+        raise IOError(f"respuesta no válida al descargar {url}")
+    return content
+
+class AssetCache:
+    """
+    Caché de recursos (imágenes, CSS, fuentes) direccionada por contenido: cada
+    URL se descarga una sola vez por ejecución y se guarda con el hash de su
+    contenido como nombre, así que dos URLs con el mismo recurso comparten archivo.
+    wkhtmltopdf lee después las copias locales en lugar de descargarlas en cada página.
+    """
+    CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.url_locks = {}
+        self.paths = {}
+        self.stylesheets = {}
+        self.used = set()
+
+    def _store(self, content, extension):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        name = hashlib.sha256(content).hexdigest() + extension
+        with self.lock:
+            self.used.add(name)
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return path
+
+    def _once(self, key, store, build):
+        # Un único hilo descarga cada URL; el resto espera y reutiliza el resultado
+        with self.lock:
+            url_lock = self.url_locks.setdefault(key, threading.Lock())
+        if not url_lock.acquire(blocking=False):
+            # La espera a la descarga de otro hilo también es tiempo de red
+            with run_stats.measure("asset_wait", key):
+                url_lock.acquire()
+        try:
+            if key not in store:
+                store[key] = build()
+            return store[key]
+        finally:
+            url_lock.release()
+
+    def local_uri(self, url, site=None):
+        """
+        URI file:// de la copia local del recurso, o None si no se pudo descargar.
+        La descarga se hace con el pool de descargas de `site` (véase SiteConfig.download).
+        """
+        site = site or SiteConfig.from_globals()
+        if urlparse(url).scheme not in ("http", "https"):
+            return None
+        
+        def build():
+            try:
+                extension = os.path.splitext(urlparse(url).path)[1]
+                if not re.fullmatch(r'\.[A-Za-z0-9]{1,8}', extension):
+                    extension = ""
+                with run_stats.measure("asset", url) as sample:
+                    content = site.download(fetch_url, url)
+                    sample["bytes"] = len(content)
+                return pathlib.Path(self._store(content, extension)).resolve().as_uri()
+            except Exception as e:
+                logger.warning(f"No se pudo descargar el recurso {url}: {str(e)}")
+                return None
+        
+        return self._once(url, self.paths, build)
+
+    def stylesheet(self, url, site=None):
+        """
+        Texto de la hoja de estilo con sus url(...) apuntando a copias locales,
+        o None si no se pudo descargar.
+        """
+        site = site or SiteConfig.from_globals()
+        
+        def build():
+            try:
+                with run_stats.measure("asset", url) as sample:
+                    content = site.download(fetch_url, url)
+                    sample["bytes"] = len(content)
+                css = content.decode("utf-8", errors="replace")
+            except Exception as e:
+                logger.warning(f"No se pudo descargar la hoja de estilo {url}: {str(e)}")
+                return None
+            
+            def localize(match):
+                reference = match.group(2).strip()
+                if reference.startswith("data:"):
+                    return match.group(0)
+                local = self.local_uri(urljoin(url, reference), site)
+                return f'url("{local}")' if local else f'url("{urljoin(url, reference)}")'
+            
+            return self.CSS_URL_PATTERN.sub(localize, css)
+        
+        return self._once(url, self.stylesheets, build)
+
+    def prune(self):
+        """
+        Elimina los recursos que no se han usado en esta ejecución.
+        """
+        with self.lock:
+            used = set(self.used)
+        try:
+            stale = [name for name in os.listdir(self.cache_dir) if name not in used]
+        except OSError:
+            return
+        for name in stale:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError as e:
+                logger.warning(f"No se pudo eliminar el recurso {name}: {str(e)}")
+        if stale:
+            logger.info(f"Caché de recursos: {len(stale)} recursos obsoletos eliminados")
+
+asset_cache = AssetCache(ASSET_CACHE_DIR)
+
+def fetch_page(url):
+    """
+    Devuelve el contenido de una página, descargándola solo si no está ya en el almacén.
+    Si otro hilo ya la está descargando, espera a esa descarga en lugar de repetirla.
+    """
+    content = page_store.get(url)
+    if content is not None:
+        return content
+    
+    with pending_fetches_lock:
+        done = pending_fetches.get(url)
+        owner = done is None
+        if owner:
+            done = pending_fetches[url] = threading.Event()
+    
+    if not owner:
+        done.wait()
+        content = page_store.get(url)
+        if content is not None:
+            return content
+        # La otra descarga falló: lo intentamos de nuevo desde este hilo
+    
+    try:
+        with run_stats.measure("fetch", url) as sample:
+            if HTTP_CACHE_ENABLED:
+                content, ok = http_cache.fetch(url)
+            else:
+                response = http_get(url)
+                content, ok = response.content, response.ok
+            sample["bytes"] = len(content or b"")
+        
+        if ok:
+            page_store.put(url, content)
+        return content
+    
+    finally:
+        if owner:
+            with pending_fetches_lock:
+                pending_fetches.pop(url, None)
+            done.set()
+
+def make_soup(content):
+    """
+    Analiza el HTML con el backend configurado en PARSER_BACKEND.
+    Si lxml no está instalado se recurre a html.parser.
+    """
+    if PARSER_BACKEND == "lxml" and etree is None:
+        logger.warning("lxml no está instalado; se usará html.parser")
+        return BeautifulSoup(content, "html.parser")
+    return BeautifulSoup(content, PARSER_BACKEND)
+
+class LinkCollector(HTMLParser):
+    """
+    Recoge los href de los enlaces con el analizador de la librería estándar,
+    sin construir el árbol del documento.
+    """
+    def __init__(self):
+        super().__init__()
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href is not None:
+                self.hrefs.append(href)
+
+class LxmlLinkTarget:
+    """
+    Destino del analizador de lxml que solo recoge los href de los enlaces.
+    """
+    def __init__(self):
+        self.hrefs = []
+
+    def start(self, tag, attrib):
+        if tag == "a" and attrib.get("href") is not None:
+            self.hrefs.append(attrib["href"])
+
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.hrefs
+
+def extract_links(content):
+    """
+    Extrae los href de todos los enlaces de una página. El crawler solo necesita
+    los enlaces, así que no se construye el árbol completo: con lxml se usa su
+    analizador en modo eventos y, si no está disponible, el HTMLParser de la
+    librería estándar.
+    """
+    if not content or not content.strip():
+        return []
+    
+    if etree is not None:
+        return etree.fromstring(content, etree.HTMLParser(target=LxmlLinkTarget()))
+    
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    collector = LinkCollector()
+    collector.feed(content)
+    collector.close()
+    return collector.hrefs
+
+class SiteConfig:
+    """
+    Configuración de un sitio de documentación: página inicial, dominio de las
+    páginas, reglas de orden, archivo de salida y detector de duplicados propio.
+    En una ejecución normal se construye con las constantes del módulo; en modo
+    batch cada entrada del archivo de trabajos tiene la suya, y `fetch_executor`
+    es su parte del pool de descargas compartido.
+    """
+    def __init__(self, name, seed_url, base_domain, output_pdf, temp_dir,
+                 section_order=(), subsection_order=None, specific_file_order=None,
+                 reference_order=(), sitemap_urls=(), discovery_mode=None, duplicates=None):
+        self.name = name
+        self.seed_url = seed_url
+        # Normalizado como las URLs con las que se compara (host en minúsculas...)
+        self.base_domain = canonicalize_url(base_domain)
+        self.output_pdf = output_pdf
+        self.temp_dir = temp_dir
+        self.section_order = list(section_order)
+        self.subsection_order = dict(subsection_order or {})
+        self.specific_file_order = dict(specific_file_order or {})
+        self.reference_order = list(reference_order)
+        self.sitemap_urls = list(sitemap_urls)
+        self.discovery_mode = discovery_mode or DISCOVERY_MODE
+        self.duplicates = duplicates if duplicates is not None else DuplicateDetector()
+        self.fetch_executor = None
+
+    @classmethod
+    def from_globals(cls):
+        return cls("default", SEED_URL, BASE_DOMAIN, OUTPUT_PDF, TEMP_DIR,
+                   SECTION_ORDER, SUBSECTION_ORDER, SPECIFIC_FILE_ORDER,
+                   REFERENCE_ORDER, SITEMAP_URLS, DISCOVERY_MODE, duplicate_detector)
+
+    # Claves admitidas en cada entrada (y en `defaults`) del archivo de trabajos
+    JOB_KEYS = ("name", "seed_url", "base_domain", "output", "temp_dir", "section_order",
+                "subsection_order", "specific_file_order", "reference_order", "sitemaps", "discovery")
+
+    @classmethod
+    def from_job(cls, entry, defaults=None):
+        """
+        Construye la configuración de una entrada del archivo de trabajos. Solo
+        `seed_url` es obligatoria; las claves que falten se toman de `defaults`.
+        Sin `base_domain`, se documenta todo el sitio (la raíz del host de
+        `seed_url`). Lanza ValueError con claves desconocidas.
+        """
+        entry = dict(defaults or {}, **entry)
+        unknown = sorted(set(entry) - set(cls.JOB_KEYS))
+        if unknown:
+            raise ValueError(f"Claves desconocidas en el trabajo {entry.get('name') or entry.get('seed_url')}: {', '.join(unknown)}")
+        if not entry.get("seed_url"):
+            raise ValueError(f"Falta seed_url en el trabajo {entry.get('name') or entry}")
+        seed_url = entry["seed_url"]
+        parsed = urlparse(seed_url)
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '-', entry.get("name") or parsed.netloc)
+        return cls(
+            name,
+            seed_url,
+            entry.get("base_domain") or f"{parsed.scheme}://{parsed.netloc}/",
+            entry.get("output") or f"{name}.pdf",
+            entry.get("temp_dir") or os.path.join(TEMP_DIR, name),
+            entry.get("section_order", ()),
+            entry.get("subsection_order"),
+            entry.get("specific_file_order"),
+            entry.get("reference_order", ()),
+            entry.get("sitemaps", ()),
+            entry.get("discovery"),
+        )
+
+    @property
+    def host(self):
+        return urlparse(self.base_domain).netloc
+
+    def download(self, fn, *args):
+        """
+        Ejecuta una descarga del sitio (`fn(*args)`) y devuelve su resultado. Con
+        `fetch_executor` pasa por el pool compartido, respetando el límite de
+        conexiones del host; si no, se hace en el hilo actual.
+        """
+        if self.fetch_executor is None:
+            return fn(*args)
+        return self.fetch_executor.run(fn, *args)
+
+    def ordering(self):
+        return UrlOrdering(self.section_order, self.subsection_order, self.specific_file_order)
+
+class FairSharePool:
+    """
+    Pool de hilos compartido entre varios sitios, con un máximo de tareas en curso
+    por clave (un host o un sitio): `limit` fijo o, sin él, los `workers` del pool
+    repartidos a partes iguales entre las claves registradas con share(). Quien
+    envía una tarea espera a que su clave tenga hueco, así que un sitio grande no
+    acapara la cola ni las conexiones a un host.
+    """
+    def __init__(self, executor, workers, limit=None):
+        self.executor = executor
+        self.workers = workers
+        self.limit = limit
+        self.condition = threading.Condition()
+        self.running = {}
+        self.active = set()
+        self.local = threading.local()
+
+    def _share(self):
+        if self.limit:
+            return self.limit
+        return max(1, math.ceil(self.workers / max(1, len(self.active))))
+
+    def _done(self, key):
+        with self.condition:
+            self.running[key] -= 1
+            self.condition.notify_all()
+
+    def submit(self, key, fn, *args, **kwargs):
+        with self.condition:
+            while self.running.get(key, 0) >= self._share():
+                self.condition.wait()
+            self.running[key] = self.running.get(key, 0) + 1
+        
+        def task():
+            self.local.worker = True
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.worker = False
+        
+        try:
+            future = self.executor.submit(task)
+        except Exception:
+            self._done(key)
+            raise
+        future.add_done_callback(lambda _: self._done(key))
+        return future
+
+    def for_key(self, key):
+        """
+        Objeto con submit() como el de un executor que envía las tareas con `key`.
+        """
+        return KeyedExecutor(self, key)
+
+    @contextlib.contextmanager
+    def share(self, key):
+        """
+        Registra la clave en el reparto mientras dura el bloque; al salir, su
+        parte se reparte entre las claves que siguen activas.
+        """
+        with self.condition:
+            self.active.add(key)
+            self.condition.notify_all()
+        try:
+            yield self.for_key(key)
+        finally:
+            with self.condition:
+                self.active.discard(key)
+                self.condition.notify_all()
+
+class KeyedExecutor:
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+
+    def submit(self, fn, *args, **kwargs):
+        return self.pool.submit(self.key, fn, *args, **kwargs)
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Ejecuta `fn` en el pool y espera su resultado. Dentro de una tarea del
+        propio pool se ejecuta directamente: ya ocupa un hueco de la clave, y
+        esperar a otra tarea podría bloquear el pool.
+        """
+        if getattr(self.pool.local, "worker", False):
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+def extract_nav_urls(seed_url, site=None):
+    """
+    Devuelve las URLs del menú de navegación de la página, en el orden del menú.
+    """
+    site = site or SiteConfig.from_globals()
+    # Obtenemos la página principal que contiene el menú completo
+    soup = make_soup(site.download(fetch_page, seed_url))
+    
+    # Buscar el menú de navegación principal
+    menu = soup.find("nav") or soup.find("div", class_="menu")
+    if not menu:
+        # Intentar encontrar otros elementos que puedan contener el menú
+        menu = soup.find("aside") or soup.find("div", class_="sidebar")
+        if not menu:
+            menu = soup  # Si no encontramos un menú específico, usamos toda la página
+    
+    # Buscar todos los enlaces en la estructura del menú
+    ordered_urls = []
+    menu_items = []
+    
+    # 1. Intentar encontrar elementos de lista que suelen representar menús
+    menu_lists = menu.find_all(["ul", "ol"])
+    if menu_lists:
+        for menu_list in menu_lists:
+            menu_items.extend(menu_list.find_all("li"))
+    
+    # 2. Si no hay elementos de lista, buscar directamente los enlaces
+    if not menu_items:
+        menu_items = menu.find_all("a", href=True)
+    else:
+        # Si tenemos elementos de lista, extraer los enlaces de cada uno
+        menu_items = [item.find("a", href=True) for item in menu_items]
+        # Filtrar elementos None (li sin enlaces)
+        menu_items = [item for item in menu_items if item]
+    
+    logger.info(f"Elementos de menú encontrados: {len(menu_items)}")
+    
+    # Procesamos cada enlace en el orden del menú
+    seen = set()
+    for item in menu_items:
+        if hasattr(item, 'href') and item['href']:
+            href = item['href']
+            absolute_url = canonicalize_url(urljoin(seed_url, href))
+            
+            if (absolute_url.startswith(site.base_domain) and 
+                absolute_url.endswith(".html") and 
+                absolute_url not in seen):
                 
-                if (absolute_url.startswith(BASE_DOMAIN) and 
-                    absolute_url.endswith(".html") and 
-                    absolute_url not in ordered_urls):
-                    
-                    ordered_urls.append(absolute_url)
-                    logger.info(f"Añadida URL del menú: {absolute_url}")
+                seen.add(absolute_url)
+                ordered_urls.append(absolute_url)
+                logger.info(f"Añadida URL del menú: {absolute_url}")
+    
+    return ordered_urls
+
+def extract_urls_ordered(seed_url):
+    """
+    Extrae URLs siguiendo el orden del menú de navegación del sitio.
+    """
+    logger.info(f"Accediendo a la página principal: {seed_url}")
+    
+    try:
+        ordered_urls = extract_nav_urls(seed_url)
         
         # Si no encontramos URLs en el menú o son muy pocas, complementamos con crawling
-        if len(ordered_urls) < 5:
+        if len(ordered_urls) < DISCOVERY_MIN_URLS:
             logger.warning("Pocas URLs encontradas en el menú. Realizando crawling adicional.")
             additional_urls = extract_urls_by_crawling(seed_url)
+            seen = set(ordered_urls)
             for url in additional_urls:
-                if url not in ordered_urls:
+                if url not in seen:
                     ordered_urls.append(url)
         
-        return ordered_urls
+        return ordered_urls
+        
+    except Exception as e:
+        logger.error(f"Error al extraer URLs ordenadas: {str(e)}")
+        # En caso de error, recurrimos al método de crawling tradicional
+        return extract_urls_by_crawling(seed_url)
+
+def parse_lastmod(value):
+    """
+    Convierte un lastmod de sitemap (fecha W3C) en un timestamp, o None si no es válido.
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def read_sitemap(sitemap_url, depth=0):
+    """
+    Lee un sitemap (o un índice de sitemaps, hasta 3 niveles) y devuelve una
+    lista de (URL, lastmod) en el orden del archivo.
+    """
+    content = fetch_url(sitemap_url)
+    if content[:2] == b"\x1f\x8b":
+        content = gzip.decompress(content)
+    root = ElementTree.fromstring(content)
+    
+    def local_name(element):
+        return element.tag.rsplit("}", 1)[-1]
+    
+    def child_text(element, name):
+        for child in element:
+            if local_name(child) == name:
+                return (child.text or "").strip()
+        return None
+    
+    entries = []
+    if local_name(root) == "sitemapindex":
+        if depth >= 3:
+            return entries
+        for sitemap in root:
+            location = child_text(sitemap, "loc")
+            if location:
+                try:
+                    entries.extend(read_sitemap(urljoin(sitemap_url, location), depth + 1))
+                except Exception as e:
+                    logger.warning(f"No se pudo leer el sitemap {location}: {str(e)}")
+    else:
+        for entry in root:
+            location = child_text(entry, "loc")
+            if location:
+                entries.append((urljoin(sitemap_url, location), parse_lastmod(child_text(entry, "lastmod"))))
+    return entries
+
+def sitemap_candidates(seed_url, site=None):
+    site = site or SiteConfig.from_globals()
+    if site.sitemap_urls:
+        return list(site.sitemap_urls)
+    parsed = urlparse(seed_url)
+    candidates = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml", urljoin(site.base_domain, "sitemap.xml")]
+    return list(dict.fromkeys(candidates))
+
+def extract_urls_from_sitemap(seed_url, site=None):
+    """
+    URLs de la documentación según el primer sitemap que se pueda leer, en el orden
+    del sitemap. Las fechas lastmod se pasan a la caché HTTP para no volver a pedir
+    las páginas que no han cambiado.
+    """
+    site = site or SiteConfig.from_globals()
+    for sitemap_url in sitemap_candidates(seed_url, site):
+        try:
+            entries = site.download(read_sitemap, sitemap_url)
+        except Exception as e:
+            logger.info(f"Sitemap no disponible en {sitemap_url}: {str(e)}")
+            continue
+        
+        urls = []
+        seen = set()
+        for url, lastmod in entries:
+            url = canonicalize_url(url)
+            if url.startswith(site.base_domain) and url.endswith(".html") and url not in seen:
+                seen.add(url)
+                urls.append(url)
+                if lastmod is not None:
+                    http_cache.lastmod[url] = lastmod
+        
+        logger.info(f"Sitemap {sitemap_url}: {len(urls)} URLs de la documentación")
+        if urls:
+            return urls
+    return []
+
+def discover_urls(seed_url, mode=None, on_url_found=None, site=None, executor=None):
+    """
+    Obtiene las URLs de la documentación con la fuente configurada: el sitemap y
+    el menú cuestan una o dos peticiones, y el crawling completo queda como
+    respaldo si no dan resultado (o, con DISCOVERY_CRAWL_MISSING, para añadir
+    las páginas que no aparecen en ellos). `executor` se pasa al crawling.
+    """
+    site = site or SiteConfig.from_globals()
+    mode = mode or site.discovery_mode
+    urls = []
+    
+    if mode in ("sitemap", "auto"):
+        urls = extract_urls_from_sitemap(seed_url, site)
+    if mode == "nav" or (mode == "auto" and len(urls) < DISCOVERY_MIN_URLS):
+        try:
+            urls = extract_nav_urls(seed_url, site)
+        except Exception as e:
+            logger.error(f"Error al leer el menú de navegación: {str(e)}")
+            urls = []
+    
+    if mode != "crawl" and len(urls) >= DISCOVERY_MIN_URLS:
+        logger.info(f"Descubiertas {len(urls)} URLs sin crawling")
+        if on_url_found:
+            for url in urls:
+                on_url_found(url)
+        if not DISCOVERY_CRAWL_MISSING:
+            return urls
+        
+        # Crawling de respaldo solo para las páginas que faltan
+        known = set(urls)
+        def report_missing(url):
+            if url not in known and on_url_found:
+                on_url_found(url)
+        crawled = extract_urls_by_crawling(seed_url, on_url_found=report_missing, site=site, executor=executor)
+        missing = [url for url in crawled if url not in known]
+        logger.info(f"El crawling añadió {len(missing)} URLs que no estaban en el sitemap ni en el menú")
+        return urls + missing
+    
+    if mode != "crawl":
+        logger.warning("No se pudieron descubrir suficientes URLs sin crawling; se recorre el sitio completo")
+    return extract_urls_by_crawling(seed_url, on_url_found=on_url_found, site=site, executor=executor)
+
+class HostRateLimiter:
+    """
+    Limita el número de peticiones por segundo que se envían a cada host.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
         
-    except Exception as e:
-        logger.error(f"Error al extraer URLs ordenadas: {str(e)}")
-        # En caso de error, recurrimos al método de crawling tradicional
-        return extract_urls_by_crawling(seed_url)
+        if slot > now:
+            time.sleep(slot - now)
+
+def fetch_links(url, rate_limiter=None):
+    """
+    Descarga una página y devuelve las URLs absolutas de todos sus enlaces.
+    """
+    if rate_limiter:
+        rate_limiter.wait(url)
+    
+    logger.info(f"Analizando por crawling: {url}")
+    content = fetch_page(url)
+    with run_stats.measure("link_extraction", url):
+        hrefs = extract_links(content)
+    logger.info(f"Enlaces encontrados: {len(hrefs)}")
+    
+    return [urljoin(url, href) for href in hrefs]
 
-def extract_urls_by_crawling(seed_url):
+def canonicalize_url(url):
+    """
+    Normaliza una URL para que la misma página no se visite dos veces: elimina el
+    fragmento, ordena los parámetros de la query, pasa el esquema y el host a
+    minúsculas y unifica la codificación de la ruta (por ejemplo, un espacio y %20).
+    La query se conserva: `?page=2` puede ser otra página.
+    """
+    parsed = urlparse(url)
+    path = quote(unquote(parsed.path), safe="/:@!$&'()*+,;=-._~")
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), path, parsed.params, query, ""))
+
+def extract_urls_by_crawling(seed_url, workers=None, rate_limit=None, on_url_found=None, site=None, executor=None):
     """
     Método de respaldo que extrae URLs mediante crawling tradicional.
+    Cada nivel del recorrido en anchura se descarga en paralelo, pero los enlaces
+    se procesan en el orden del nivel para que el resultado sea determinista.
+    Si se indica `on_url_found(url)`, se llama con cada URL nueva en cuanto se descubre.
+    Con `executor`, las descargas van a ese pool compartido en lugar de a uno propio.
     """
-    visited = set()
-    to_visit = [seed_url]
+    site = site or SiteConfig.from_globals()
+    workers = workers or CRAWL_WORKERS
+    rate_limiter = HostRateLimiter(CRAWL_RATE_LIMIT if rate_limit is None else rate_limit)
+    
+    seed_url = canonicalize_url(seed_url)
+    frontier = deque([(seed_url, 0)])
+    queued = {seed_url}
+    found = set()
     all_urls = []
     
-    while to_visit:
-        url = to_visit.pop(0)
-        if url in visited:
-            continue
-        
-        try:
-            logger.info(f"Analizando por crawling: {url}")
-            response = requests.get(url, headers=HEADERS, timeout=10)
-            soup = BeautifulSoup(response.content, "html.parser")
-            
-            links = soup.find_all("a", href=True)
-            logger.info(f"Enlaces encontrados: {len(links)}")
+    def limit_reached():
+        return CRAWL_MAX_PAGES and len(all_urls) >= CRAWL_MAX_PAGES
+    
+    with (ThreadPoolExecutor(max_workers=workers) if executor is None else contextlib.nullcontext(executor)) as executor:
+        while frontier and not limit_reached():
+            # La frontera contiene exactamente un nivel del recorrido en anchura
+            level = [frontier.popleft() for _ in range(len(frontier))]
+            futures = [executor.submit(fetch_links, url, rate_limiter) for url, _ in level]
             
-            for link in links:
-                href = link["href"]
-                absolute_url = urljoin(url, href)
+            for (url, depth), future in zip(level, futures):
+                if limit_reached():
+                    # Los enlaces del resto del nivel ya no se usarían
+                    future.cancel()
+                    continue
+                try:
+                    links = future.result()
+                except Exception as e:
+                    logger.error(f"Error en crawling {url}: {str(e)}")
+                    continue
                 
-                if (absolute_url.startswith(BASE_DOMAIN) 
-                    and absolute_url.endswith(".html") 
-                    and absolute_url not in all_urls):
+                for link in links:
+                    absolute_url = canonicalize_url(link)
+                    if (not absolute_url.startswith(site.base_domain) 
+                        or not urlparse(absolute_url).path.endswith(".html") 
+                        or absolute_url in found):
+                        continue
                     
+                    if limit_reached():
+                        break
+                    found.add(absolute_url)
                     all_urls.append(absolute_url)
-                    to_visit.append(absolute_url)
-            
-            visited.add(url)
-        
-        except Exception as e:
-            logger.error(f"Error en crawling {url}: {str(e)}")
+                    if on_url_found:
+                        on_url_found(absolute_url)
+                    
+                    if absolute_url not in queued and (not CRAWL_MAX_DEPTH or depth < CRAWL_MAX_DEPTH):
+                        queued.add(absolute_url)
+                        frontier.append((absolute_url, depth + 1))
+    
+    if limit_reached():
+        logger.warning(f"Se alcanzó el límite de {CRAWL_MAX_PAGES} URLs durante el crawling")
     
     # Ordenamos por la estructura de carpetas y nombres para mantener cierta lógica
     return sorted(all_urls)
@@ -194,40 +1457,6 @@ def format_json(text):
         # Si no es un JSON válido, devolver el texto original
         return text
 
-def extract_json_examples(html_content):
-    """
-    Busca y extrae ejemplos de JSON del contenido HTML para procesarlos por separado.
-    Evita duplicados verificando el contenido normalizado.
-    """
-    soup = BeautifulSoup(html_content, "html.parser")
-    examples = []
-    processed_texts = set()  # Conjunto para almacenar textos ya procesados
-    
-    # Identificar contenedores comunes de ejemplos de código/JSON
-    selectors = [
-        'pre', 'code', '.example', '.code-example', '.json-example', 
-        '.request-example', '.response-example', '.curl-example'
-    ]
-    
-    for selector in selectors:
-        elements = soup.select(selector)
-        for element in elements:
-            text = element.get_text(strip=True)
-            
-            # Verificar si el texto parece un objeto JSON (comienza y termina con llaves)
-            if (text.strip().startswith('{') and text.strip().endswith('}')) or \
-               (text.strip().startswith('[') and text.strip().endswith(']')):
-                
-                # Normalizar el texto para evitar duplicados por espacios/formato
-                normalized_text = ''.join(text.split())
-                
-                # Verificar si ya hemos procesado este texto
-                if normalized_text not in processed_texts:
-                    processed_texts.add(normalized_text)
-                    examples.append(element)
-    
-    return examples
-
 def preserve_json_format(element):
     """
     Preserva el formato de los elementos JSON para mostrarlos correctamente en el PDF.
@@ -331,23 +1560,159 @@ def extract_table_content(table):
     
     return "\n".join(table_content)
 
-def process_content_containers(soup):
+# Etiquetas que se eliminan del documento antes de convertirlo
+REMOVED_TAGS = {"header", "footer", "nav", "script", "style"}
+
+# Contenedores comunes de ejemplos de código/JSON
+JSON_SELECTORS = [
+    'pre', 'code', '.example', '.code-example', '.json-example', 
+    '.request-example', '.response-example', '.curl-example'
+]
+
+# Patrones comunes para identificar contenedores de código en documentación de APIs
+CODE_SELECTORS = [
+    "div.playground-wrapper", "div.request-example", "div.response-example",
+    "div.code-block", "div.example", "div.api-example", 
+    "div.tab-content", "div.tabbed-example", "div.curl-example",
+    "div.language-bash", "div.language-json", "div.language-javascript",
+    ".swagger-ui .opblock .opblock-section .opblock-section-header"
+]
+
+# Contenedores que suelen tener tablas de parámetros
+PARAM_SELECTORS = [
+    "div.parameters", "div.params", "div.request-parameters", 
+    "div.response-parameters", "div.param-container",
+    ".swagger-ui .opblock .opblock-section .parameters-container",
+    ".swagger-ui .opblock .opblock-section .responses-wrapper",
+    "div.push-parameters", "div.request-parameters"
+]
+
+# Términos de clase de contenedores con pestañas o barras de navegación
+TAB_CLASS_PATTERN = re.compile('tab|example')
+NAV_CLASS_PATTERN = re.compile('scroll|nav|slider|container|params|parameter')
+
+REQUEST_EXAMPLE_PATTERN = re.compile(r'request example', re.IGNORECASE)
+
+def compile_selectors(selectors):
     """
-    Procesa bloques de código, tablas y otros contenedores con barras de navegación
-    para que se muestren correctamente en el PDF.
+    Compila una lista de selectores CSS y los indexa por la etiqueta o la primera
+    clase de su último componente. Así cada nodo solo se compara con los selectores
+    que pueden coincidir con él, en lugar de evaluar la lista completa.
+    """
+    by_tag = {}
+    by_class = {}
+    for rank, selector in enumerate(selectors):
+        tag, *classes = selector.split()[-1].split(".")
+        if classes:
+            by_class.setdefault(classes[0], []).append(rank)
+        else:
+            by_tag.setdefault(tag, []).append(rank)
+    return by_tag, by_class, [soupsieve.compile(selector) for selector in selectors]
+
+JSON_MATCHERS = compile_selectors(JSON_SELECTORS)
+CODE_MATCHERS = compile_selectors(CODE_SELECTORS)
+PARAM_MATCHERS = compile_selectors(PARAM_SELECTORS)
+
+def selector_rank(node, matchers):
+    """
+    Devuelve la posición del primer selector que coincide con el nodo, o None.
+    """
+    by_tag, by_class, compiled = matchers
+    candidates = list(by_tag.get(node.name, ()))
+    for cls in node.get('class') or ():
+        candidates.extend(by_class.get(cls, ()))
+    
+    for rank in sorted(candidates):
+        if compiled[rank].match(node):
+            return rank
+    return None
+
+def has_class_term(node, pattern):
+    """
+    Indica si alguna clase del nodo contiene alguno de los términos del patrón.
+    """
+    return any(pattern.search(cls.lower()) for cls in node.get('class') or ())
+
+def looks_like_json(text):
     """
-    # 1. Identificar y eliminar ejemplos duplicados
-    # Buscar elementos específicos que pueden contener ejemplos duplicados
-    request_examples = soup.find_all(string=re.compile(r'request example', re.IGNORECASE))
-    for example_text in request_examples:
+    Indica si el texto tiene forma de objeto o lista JSON.
+    """
+    text = text.strip()
+    return (text.startswith('{') and text.endswith('}')) or \
+           (text.startswith('[') and text.endswith(']'))
+
+# Visitantes del pipeline de transformación, en orden de aplicación
+PAGE_VISITORS = []
+
+def register_visitor(name, match, handle):
+    """
+    Registra un visitante del pipeline de transformación de páginas.
+    `match(node)` se evalúa durante el único recorrido del árbol y devuelve una
+    prioridad (o None si el nodo no le interesa); después `handle(nodes, soup, context)`
+    recibe los nodos seleccionados ordenados por prioridad y orden de documento.
+    """
+    PAGE_VISITORS.append((name, match, handle))
+
+def walk_document(soup):
+    """
+    Recorre el árbol en orden de documento. Las etiquetas de REMOVED_TAGS se
+    eliminan en el propio recorrido, sin descender en ellas.
+    """
+    stack = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tag):
+            if node.name in REMOVED_TAGS:
+                node.decompose()
+                continue
+            stack.extend(reversed(node.contents))
+        yield node
+
+def is_detached(node):
+    """
+    Indica si un nodo ya fue eliminado o sustituido por un visitante anterior.
+    """
+    return node.decomposed or node.parent is None
+
+def match_curl_example(node):
+    if isinstance(node, NavigableString) and node.strip().startswith('curl-X'):
+        return 0
+    return None
+
+def dedup_curl_examples(nodes, soup, context):
+    # Identificar patrón de duplicación específico de la documentación de Bitunix
+    # Buscar patrones como 'curl-X'GET'--...' duplicados
+    processed_curls = set()
+    
+    for curl_text in nodes:
+        if is_detached(curl_text):
+            continue
+        # Normalizar el texto del curl para comparar
+        normalized = re.sub(r'\s+', ' ', curl_text.strip())
+        if normalized in processed_curls:
+            # Es un duplicado, eliminar este nodo
+            if curl_text.parent:
+                curl_text.parent.decompose()
+        else:
+            processed_curls.add(normalized)
+
+def match_request_example(node):
+    if isinstance(node, NavigableString) and REQUEST_EXAMPLE_PATTERN.search(node):
+        return 0
+    return None
+
+def dedup_request_examples(nodes, soup, context):
+    # Identificar y eliminar ejemplos duplicados
+    for example_text in nodes:
+        if is_detached(example_text):
+            continue
         parent = example_text.parent
         if parent:
             # Buscar el siguiente elemento que contiene el ejemplo
-            next_siblings = list(parent.next_siblings)
             json_blocks = []
             
-            # Recopilar bloques JSON consecutivos
-            for sibling in next_siblings:
+            # Recopilar bloques JSON consecutivos (sin copiar todos los hermanos siguientes)
+            for sibling in parent.next_siblings:
                 if sibling.name in ['pre', 'code'] or (hasattr(sibling, 'get_text') and 
                    sibling.get_text().strip().startswith('{')):
                     json_blocks.append(sibling)
@@ -359,74 +1724,60 @@ def process_content_containers(soup):
             if len(json_blocks) > 1:
                 for block in json_blocks[1:]:
                     block.decompose()
+
+def match_json_block(node):
+    if isinstance(node, Tag):
+        return selector_rank(node, JSON_MATCHERS)
+    return None
+
+def format_json_blocks(nodes, soup, context):
+    # Procesar ejemplos de JSON para preservar su formato.
+    # Evita duplicados verificando el contenido normalizado.
+    processed_texts = set()
     
-    # 2. Procesar ejemplos de JSON para preservar su formato
-    json_examples = extract_json_examples(str(soup))
-    for element in json_examples:
-        preserve_json_format(element)
-    
-    # 2. Procesar bloques de código
-    # Patrones comunes para identificar contenedores de código
-    code_containers = []
-    
-    # Buscar divs con clases específicas comunes en documentación de APIs
-    code_selectors = [
-        "div.playground-wrapper", "div.request-example", "div.response-example",
-        "div.code-block", "div.example", "div.api-example", 
-        "div.tab-content", "div.tabbed-example", "div.curl-example",
-        "div.language-bash", "div.language-json", "div.language-javascript",
-        ".swagger-ui .opblock .opblock-section .opblock-section-header"
-    ]
-    
-    for selector in code_selectors:
-        try:
-            elements = soup.select(selector)
-            code_containers.extend(elements)
-        except Exception:
-            pass
-    
-    # Buscar elementos pre y code directamente
-    pre_elements = soup.find_all('pre')
-    code_elements = soup.find_all('code')
-    code_containers.extend(pre_elements)
-    code_containers.extend(code_elements)
-    
-    # Buscar divs que contienen navegación de pestañas (común en documentaciones de API)
-    tab_containers = soup.find_all('div', class_=lambda x: x and ('tab' in x.lower() or 'example' in x.lower()))
-    code_containers.extend(tab_containers)
-    
-    # 3. Procesar tablas y contenedores de parámetros
-    table_containers = []
-    
-    # Buscar tablas directamente
-    tables = soup.find_all('table')
-    table_containers.extend(tables)
-    
-    # Buscar contenedores que suelen tener tablas de parámetros
-    param_selectors = [
-        "div.parameters", "div.params", "div.request-parameters", 
-        "div.response-parameters", "div.param-container",
-        ".swagger-ui .opblock .opblock-section .parameters-container",
-        ".swagger-ui .opblock .opblock-section .responses-wrapper",
-        "div.push-parameters", "div.request-parameters"
-    ]
-    
-    for selector in param_selectors:
-        try:
-            elements = soup.select(selector)
-            table_containers.extend(elements)
-        except Exception:
-            pass
-    
-    # Contenedores que pueden tener barras de navegación y que incluyen tablas
-    nav_containers = soup.find_all(['div', 'section'], class_=lambda x: x and any(term in (x.lower() if x else "") for term in ['scroll', 'nav', 'slider', 'container', 'params', 'parameter']))
-    table_containers.extend(nav_containers)
+    for element in nodes:
+        if is_detached(element):
+            continue
+        text = element.get_text(strip=True)
+        if not looks_like_json(text):
+            continue
+        
+        # Los bloques JSON no se vuelven a tratar como bloques de código
+        context["json_blocks"].add(id(element))
+        
+        # Normalizar el texto para evitar duplicados por espacios/formato
+        normalized_text = ''.join(text.split())
+        if normalized_text not in processed_texts:
+            processed_texts.add(normalized_text)
+            preserve_json_format(element)
+
+def match_code_container(node):
+    if not isinstance(node, Tag):
+        return None
+    rank = selector_rank(node, CODE_MATCHERS)
+    if rank is not None:
+        return rank
+    if node.name == 'pre':
+        return len(CODE_SELECTORS)
+    if node.name == 'code':
+        return len(CODE_SELECTORS) + 1
+    # Divs con navegación de pestañas (común en documentaciones de API)
+    if node.name == 'div' and has_class_term(node, TAB_CLASS_PATTERN):
+        return len(CODE_SELECTORS) + 2
+    return None
+
+def process_code_containers(nodes, soup, context):
+    # Índice por identidad de los hijos directos de los contenedores de tabla,
+    # calculado una sola vez en lugar de recorrer cada contenedor por cada bloque
+    table_children = {id(child) for tc in context["matches"]["tables"] for child in tc.contents}
     
-    # 4. Procesar los contenedores de código (que no han sido procesados como JSON)
-    for container in code_containers:
+    # Procesar los contenedores de código (que no han sido procesados como JSON)
+    for container in nodes:
         try:
+            if is_detached(container):
+                continue
             # Verificar si no es parte de un contenedor de tabla ya procesado o un ejemplo JSON ya procesado
-            if any(container in tc for tc in table_containers) or any(container == ex for ex in json_examples):
+            if id(container) in table_children or id(container) in context["json_blocks"]:
                 continue
                 
             # Extraer el texto del código
@@ -434,8 +1785,7 @@ def process_content_containers(soup):
             
             if code_text and len(code_text) > 10:  # Filtrar bloques muy pequeños
                 # Intentar detectar si es un JSON y formatearlo
-                if (code_text.strip().startswith('{') and code_text.strip().endswith('}')) or \
-                   (code_text.strip().startswith('[') and code_text.strip().endswith(']')):
+                if looks_like_json(code_text):
                     try:
                         code_text = format_json(code_text.strip())
                     except:
@@ -449,10 +1799,26 @@ def process_content_containers(soup):
                 container.replace_with(new_pre)
         except Exception as e:
             logger.warning(f"No se pudo procesar un bloque de código: {str(e)}")
-    
-    # 5. Procesar los contenedores de tablas
-    for container in table_containers:
+
+def match_table_container(node):
+    if not isinstance(node, Tag):
+        return None
+    # Primero las tablas, después los contenedores de parámetros y por último
+    # los contenedores con barras de navegación que pueden incluir tablas
+    if node.name == 'table':
+        return 0
+    rank = selector_rank(node, PARAM_MATCHERS)
+    if rank is not None:
+        return 1 + rank
+    if node.name in ('div', 'section') and has_class_term(node, NAV_CLASS_PATTERN):
+        return 1 + len(PARAM_SELECTORS)
+    return None
+
+def process_table_containers(nodes, soup, context):
+    for container in nodes:
         try:
+            if is_detached(container):
+                continue
             # Buscar tablas dentro del contenedor
             tables = container.find_all('table')
             
@@ -496,125 +1862,1058 @@ def process_content_containers(soup):
                     container.replace_with(table_pre)
         except Exception as e:
             logger.warning(f"No se pudo procesar un contenedor de tabla: {str(e)}")
+
+def match_resource_link(node):
+    if isinstance(node, Tag) and node.name in ("img", "link"):
+        return 0
+    return None
+
+def absolutize_resource_links(nodes, soup, context):
+    # Convertir rutas relativas a absolutas
+    base_url = context["base_url"]
+    if not base_url:
+        return
+    for tag in nodes:
+        for attr in ["src", "href"]:
+            if tag.get(attr):
+                tag[attr] = urljoin(base_url, tag[attr])
+
+def localize_assets(nodes, soup, context):
+    # Sustituir imágenes y hojas de estilo remotas por sus copias locales
+    if not ASSET_CACHE_ENABLED or not context["base_url"]:
+        return
+    for tag in nodes:
+        if tag.name == "img" and tag.get("src"):
+            local = asset_cache.local_uri(tag["src"], context["site"])
+            if local:
+                tag["src"] = local
+        elif tag.name == "link" and "stylesheet" in (tag.get("rel") or []) and tag.get("href"):
+            if INLINE_STYLESHEETS:
+                css = asset_cache.stylesheet(tag["href"], context["site"])
+                if css is not None:
+                    style_tag = soup.new_tag("style")
+                    if tag.get("media"):
+                        style_tag["media"] = tag["media"]
+                    style_tag.string = css
+                    tag.replace_with(style_tag)
+            else:
+                local = asset_cache.local_uri(tag["href"], context["site"])
+                if local:
+                    tag["href"] = local
+
+register_visitor("curl", match_curl_example, dedup_curl_examples)
+register_visitor("request_examples", match_request_example, dedup_request_examples)
+register_visitor("json", match_json_block, format_json_blocks)
+register_visitor("code", match_code_container, process_code_containers)
+register_visitor("tables", match_table_container, process_table_containers)
+register_visitor("links", match_resource_link, absolutize_resource_links)
+register_visitor("assets", match_resource_link, localize_assets)
+
+def process_content_containers(soup, base_url=None, site=None):
+    """
+    Procesa bloques de código, tablas y otros contenedores con barras de navegación
+    para que se muestren correctamente en el PDF.
+    El árbol se recorre una sola vez: cada visitante registrado selecciona sus nodos
+    durante el recorrido y después los edita en el propio árbol, en orden de registro.
+    """
+    matches = {name: [] for name, _, _ in PAGE_VISITORS}
+    
+    for node in walk_document(soup):
+        for name, match, _ in PAGE_VISITORS:
+            rank = match(node)
+            if rank is not None:
+                matches[name].append((rank, node))
+    
+    context = {"base_url": base_url, "site": site, "json_blocks": set(), "matches": {}}
+    for name, _, _ in PAGE_VISITORS:
+        # Orden estable: prioridad del visitante y, a igualdad, orden de documento
+        context["matches"][name] = [node for _, node in sorted(matches[name], key=lambda item: item[0])]
+    
+    for name, _, handle in PAGE_VISITORS:
+        handle(context["matches"][name], soup, context)
+    
+    return soup
+
+class DuplicateDetector:
+    """
+    Detecta páginas casi duplicadas mediante simhash de 64 bits sobre tríos de
+    palabras del texto procesado. Los hashes se indexan por bandas: con más bandas
+    que DUPLICATE_MAX_DISTANCE, dos hashes a esa distancia de Hamming o menor
+    coinciden al menos en una banda, así que cada página solo se compara con unas
+    pocas candidatas. Se conserva siempre la primera página vista de cada grupo;
+    si las URLs se registran con expect(), "primera" es según ese orden y no
+    según el hilo que termine antes.
+    """
+    SHINGLE_SIZE = 3
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.band_layout = None
+        self.bands = {}
+        self.seen = set()
+        self.fingerprints = {}
+        self.duplicates = []
+        self.positions = {}
+        self.decided = set()
+        self.next_position = 0
+
+    @classmethod
+    def simhash(cls, words):
+        shingles = {" ".join(words[i:i + cls.SHINGLE_SIZE]) for i in range(len(words) - cls.SHINGLE_SIZE + 1)}
+        if not shingles:
+            return 0
+        # Cada columna de la matriz de bits se cuenta de una vez con str.count
+        bits = [format(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+                for shingle in shingles]
+        value = 0
+        for column in zip(*bits):
+            value = (value << 1) | (column.count("1") * 2 > len(bits))
+        return value
+
+    @staticmethod
+    def band_layout_for(max_distance):
+        """
+        (desplazamiento, ancho) de cada banda: DUPLICATE_MAX_DISTANCE + 1 bandas
+        de anchos casi iguales. Con 64 bits no caben más de 64 bandas, así que a
+        partir de una distancia de 64 hay una sola banda vacía y toda página
+        es candidata.
+        """
+        count = max(1, max_distance + 1)
+        if count > 64:
+            return [(0, 0)]
+        edges = [64 * band // count for band in range(count + 1)]
+        return [(start, end - start) for start, end in zip(edges, edges[1:])]
+
+    def _band_keys(self, value):
+        if self.band_layout is None:
+            self.band_layout = self.band_layout_for(DUPLICATE_MAX_DISTANCE)
+        return [(band, (value >> start) & ((1 << width) - 1))
+                for band, (start, width) in enumerate(self.band_layout)]
+
+    def _add(self, url, value):
+        self.seen.add(url)
+        self.fingerprints[url] = value
+        for key in self._band_keys(value):
+            self.bands.setdefault(key, []).append((url, value))
+
+    def expect(self, url):
+        """
+        Registra la posición de `url` en el orden del crawling. check() y
+        restore() de una URL registrada esperan a que se hayan decidido todas
+        las anteriores, y cada URL registrada debe pasar por check(), restore()
+        o release() para no bloquear a las siguientes.
+        """
+        with self.lock:
+            self.positions.setdefault(url, len(self.positions))
+
+    def _wait_turn(self, url):
+        position = self.positions.get(url)
+        while position is not None and self.next_position < position:
+            self.lock.wait()
+
+    def release(self, url):
+        """
+        Da por decidida `url` sin registrarla (por ejemplo, si no se pudo procesar).
+        """
+        with self.lock:
+            position = self.positions.get(url)
+            if position is None or position in self.decided:
+                return
+            self.decided.add(position)
+            while self.next_position in self.decided:
+                self.next_position += 1
+            self.lock.notify_all()
+
+    def restore(self, url, value):
+        """
+        Registra como original una página recuperada de la ejecución anterior,
+        con el simhash guardado en el diario, sin volver a procesarla.
+        """
+        with self.lock:
+            self._wait_turn(url)
+            if value is not None and url not in self.seen:
+                self._add(url, value)
+            self.release(url)
+
+    def check(self, url, text):
+        """
+        Devuelve (URL original, distancia) si la página es casi igual a una ya
+        vista; si no, la registra y devuelve None.
+        """
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < DUPLICATE_MIN_WORDS:
+            self.release(url)
+            return None
+        value = self.simhash(words)
+        
+        with self.lock:
+            self._wait_turn(url)
+            try:
+                if url in self.seen:
+                    return None
+                best = None
+                for key in self._band_keys(value):
+                    for other_url, other_value in self.bands.get(key, []):
+                        distance = bin(value ^ other_value).count("1")
+                        if distance <= DUPLICATE_MAX_DISTANCE and (best is None or distance < best[1]):
+                            best = (other_url, distance)
+                
+                if best:
+                    self.duplicates.append({"url": url, "duplicate_of": best[0], "distance": best[1]})
+                    return best
+                self._add(url, value)
+                return None
+            finally:
+                self.release(url)
+
+duplicate_detector = DuplicateDetector()
+
+def collapse_duplicate(soup, original_url):
+    """
+    Sustituye el contenido de la página por su título y un enlace a la original.
+    """
+    body = soup.body or soup
+    heading = body.find(["h1", "h2"])
+    heading = heading.extract() if heading else None
+    body.clear()
+    if heading:
+        body.append(heading)
+    note = soup.new_tag("p")
+    note.append("Esta página es prácticamente idéntica a ")
+    link = soup.new_tag("a", href=original_url)
+    link.string = original_url
+    note.append(link)
+    note.append(" y se ha omitido su contenido.")
+    body.append(note)
+    return soup
+
+def process_page(url, site=None, content=None):
+    """
+    Descarga (si no se pasa `content`) y limpia una página, y devuelve su árbol
+    listo para convertir a PDF, o None si es un duplicado que se debe omitir.
+    """
+    site = site or SiteConfig.from_globals()
+    if content is None:
+        content = site.download(fetch_page, url)
+    with run_stats.measure("parse", url):
+        soup = make_soup(content)
+    
+    # Eliminar navegación y scripts, quitar ejemplos duplicados, procesar los
+    # bloques de código y tablas especiales y convertir rutas relativas a absolutas
+    base_url = url.rsplit("/", 1)[0] + "/"
+    with run_stats.measure("process_content_containers", url):
+        soup = process_content_containers(soup, base_url, site)
+    
+    # Mejorar la presentación general del documento
+    # Agregar estilo para mejorar la legibilidad y preservar formato de código
+    style_tag = soup.new_tag('style')
+    style_tag.string = """
+        body { font-family: Arial, sans-serif; line-height: 1.5; }
+        table { border-collapse: collapse; width: 100%; margin: 15px 0; }
+        th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+        th { background-color: #f2f2f2; }
+        h1, h2, h3, h4, h5, h6 { margin-top: 20px; }
+        pre { background-color: #f5f5f5; padding: 10px; border-radius: 4px; overflow-x: auto; white-space: pre-wrap; }
+        code { font-family: monospace; background-color: #f5f5f5; padding: 2px 4px; }
+        .code-example, .request-example, .response-example { 
+            background-color: #f5f5f5; 
+            padding: 10px; 
+            border-radius: 4px; 
+            margin: 10px 0;
+            font-family: monospace;
+            white-space: pre-wrap;
+        }
+    """
+    soup.head.append(style_tag) if soup.head else soup.append(style_tag)
+    
+    # Páginas casi idénticas a otra ya procesada
+    if DUPLICATE_MODE != "off":
+        duplicate = site.duplicates.check(url, (soup.body or soup).get_text(" "))
+        if duplicate:
+            logger.info(f"Página casi duplicada de {duplicate[0]} (distancia {duplicate[1]}): {url}")
+            if DUPLICATE_MODE == "skip":
+                return None
+            collapse_duplicate(soup, duplicate[0])
+        elif url in site.duplicates.fingerprints:
+            # Para que --resume pueda volver a registrarla sin procesarla
+            run_journal.record_fingerprint(url, site.duplicates.fingerprints[url])
     
     return soup
 
-def process_html(url):
+def process_html(url, site=None):
+    site = site or SiteConfig.from_globals()
+    try:
+        # La descarga queda fuera de process_html: se mide como su propia etapa
+        content = site.download(fetch_page, url)
+        with run_stats.measure("process_html", url):
+            soup = process_page(url, site, content)
+            if soup is None:
+                return None
+            html_content = str(soup)
+            if MEMORY_BOUNDED:
+                soup.decompose()
+            return html_content
+    
+    except Exception as e:
+        logger.error(f"Error procesando {url}: {str(e)}")
+        return None
+
+class RenderCache:
+    """
+    Caché persistente de PDFs por página. El manifiesto asocia el hash del HTML
+    procesado y de las opciones de pdfkit con el PDF generado, de modo que las
+    páginas sin cambios no se vuelven a renderizar.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.lock = threading.Lock()
+        self.used = set()
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    @staticmethod
+    def content_hash(html_content, options):
+        digest = hashlib.sha256(html_content.encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.manifest.get(key)
+            if entry:
+                self.used.add(key)
+        if entry and os.path.exists(os.path.join(self.cache_dir, entry["file"])):
+            return os.path.join(self.cache_dir, entry["file"])
+        return None
+
+    def path_for(self, key):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def add(self, key, url):
+        with self.lock:
+            self.manifest[key] = {"file": f"{key}.pdf", "url": url}
+            self.used.add(key)
+            self._save()
+
+    def restore(self, key, url):
+        """
+        Marca como usado el PDF de una página recuperada del diario con --resume y,
+        si la ejecución anterior se interrumpió antes de registrarlo, lo añade al manifiesto.
+        """
+        with self.lock:
+            if key not in self.manifest:
+                if not os.path.exists(os.path.join(self.cache_dir, f"{key}.pdf")):
+                    return
+                self.manifest[key] = {"file": f"{key}.pdf", "url": url}
+                self._save()
+            self.used.add(key)
+
+    def prune(self):
+        """
+        Elimina los PDFs que no se han usado en esta ejecución.
+        """
+        with self.lock:
+            stale = [key for key in self.manifest if key not in self.used]
+            for key in stale:
+                path = os.path.join(self.cache_dir, self.manifest.pop(key)["file"])
+                if os.path.exists(path):
+                    os.remove(path)
+            self._save()
+        if stale:
+            logger.info(f"Caché de renderizado: {len(stale)} PDFs obsoletos eliminados")
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+render_cache = RenderCache(RENDER_CACHE_DIR)
+
+def build_pdf_options(page_name, profile=None):
+    """
+    Opciones de wkhtmltopdf para renderizar una página de la documentación, con
+    los cambios del perfil de renderizado indicado.
+    """
+    options = {
+        "encoding": "UTF-8",
+        "page-size": "A4",
+        "margin-top": "20mm",
+        "margin-right": "15mm",
+        "margin-bottom": "20mm",
+        "margin-left": "15mm",
+        "enable-local-file-access": "",
+        "quiet": "",
+        # Opciones para mejorar la legibilidad
+        "print-media-type": "",
+        "no-background": "",
+        # Agregar encabezado y pie de página
+        "header-center": page_name,
+        "header-font-size": "9",
+        "header-spacing": "5",
+        "footer-center": f"Página [page] de [topage]",
+        "footer-font-size": "8",
+        # Ajustes para mejorar la presentación de las tablas
+        "dpi": "300",
+        # Ajuste para asegurar que se muestren todos los contenidos
+        "javascript-delay": "1000",
+        # Opciones para preservar formato de código
+        "enable-smart-shrinking": "",
+    }
+    
+    for key, value in RENDER_PROFILES[profile or "print"].items():
+        if value is None:
+            options.pop(key, None)
+        else:
+            options[key] = value
+    return options
+
+# Contenido que, tras procesar la página, todavía necesita JavaScript o imágenes a alta resolución
+SCRIPT_MARKERS = re.compile(r'<(script|iframe|canvas|object|embed)\b|<[^>]+\son[a-z]+\s*=', re.IGNORECASE)
+# (en el CSS, solo los url() de imágenes: las hojas de estilo incrustadas también
+# traen url() de fuentes que no necesitan más resolución)
+IMAGE_MARKERS = re.compile(
+    r'<(img|svg|picture|video)\b'
+    r'|url\(\s*[\'"]?(data:image/|[^\'")]*\.(png|jpe?g|gif|svg|webp|avif|bmp|ico)([?#][^\'")]*)?\s*[\'"]?\s*\))',
+    re.IGNORECASE)
+
+def resolve_render_profile(html_content):
+    """
+    Perfil con el que se renderiza un HTML. En modo "auto" se mantiene la espera de
+    JavaScript solo si la página aún tiene scripts y los 300 dpi solo si tiene imágenes.
+    """
+    if RENDER_PROFILE != "auto":
+        return RENDER_PROFILE
+    if SCRIPT_MARKERS.search(html_content):
+        return "print"
+    if IMAGE_MARKERS.search(html_content):
+        return "fast"
+    return "text"
+
+class SpooledHtml:
+    """
+    HTML procesado que espera su turno de renderizado en un archivo temporal en
+    lugar de en memoria. wkhtmltopdf lo lee directamente del disco.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def write(cls, html_content, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html_content)
+        return cls(path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def spool_if_bounded(html_content, output_path):
+    """
+    En modo de memoria acotada, guarda el HTML junto al PDF de destino y devuelve
+    el SpooledHtml; en otro caso devuelve el HTML tal cual.
+    """
+    if not MEMORY_BOUNDED:
+        return html_content
+    return SpooledHtml.write(html_content, os.path.splitext(output_path)[0] + ".html")
+
+class WkhtmltopdfRenderer:
+    """
+    Backend por defecto: un proceso de wkhtmltopdf por página, que recibe el HTML
+    por la entrada estándar o lo lee del disco si es un SpooledHtml.
+    """
+    name = "wkhtmltopdf"
+
+    def render(self, html_content, output_path, options, toc=None):
+        if isinstance(html_content, SpooledHtml):
+            renderer = pdfkit.PDFKit(html_content.path, "file", options=options, toc=toc, configuration=config)
+            stdin_content = None
+        else:
+            renderer = pdfkit.PDFKit(html_content, "string", options=options, toc=toc, configuration=config)
+            stdin_content = html_content.encode("utf-8")
+        
+        try:
+            result = subprocess.run(
+                renderer.command(output_path),
+                input=stdin_content,
+                capture_output=True,
+                timeout=RENDER_TIMEOUT,
+                env=renderer.environ
+            )
+        except subprocess.TimeoutExpired:
+            raise TimeoutError(f"wkhtmltopdf superó el límite de {RENDER_TIMEOUT} s")
+        stderr = (result.stderr or result.stdout or b"").decode("utf-8", errors="replace")
+        renderer.handle_error(result.returncode, stderr)
+
+    def close(self):
+        pass
+
+# Variables de los encabezados de wkhtmltopdf y su equivalente en CSS paginado
+CSS_PAGE_VARIABLES = {
+    "[page]": "counter(page)",
+    "[topage]": "counter(pages)",
+    "[section]": "string(section)",
+}
+
+# WeasyPrint se importa solo si se usa: sin Pango, importarlo imprime un aviso en cada ejecución
+weasyprint = None
+weasyprint_checked = False
+weasyprint_fonts = None
+
+def load_weasyprint():
+    """
+    Importa WeasyPrint la primera vez que se necesita. Devuelve el módulo, o None
+    si no está instalado o le faltan las bibliotecas de Pango.
+    """
+    global weasyprint, weasyprint_checked
+    if not weasyprint_checked:
+        weasyprint_checked = True
+        if importlib.util.find_spec("weasyprint") is not None:
+            try:
+                weasyprint = importlib.import_module("weasyprint")
+            except (ImportError, OSError) as e:
+                logger.warning(f"No se pudo cargar WeasyPrint: {str(e)}")
+    return weasyprint
+
+def weasyprint_worker_init():
+    """
+    Prepara un proceso de WeasyPrint: renderiza un documento vacío para que la
+    configuración de fuentes quede cargada antes de la primera página.
+    """
+    global weasyprint_fonts
+    load_weasyprint()
+    try:
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:  # WeasyPrint < 53
+        from weasyprint.fonts import FontConfiguration
+    weasyprint_fonts = FontConfiguration()
+    weasyprint.HTML(string="<p></p>").write_pdf(font_config=weasyprint_fonts)
+
+def weasyprint_render(source, is_file, output_path, page_css):
+    """
+    Renderiza un HTML (o un archivo HTML si `is_file`) dentro de un proceso de WeasyPrint.
+    """
+    stylesheet = weasyprint.CSS(string=page_css, font_config=weasyprint_fonts)
+    document = weasyprint.HTML(filename=source) if is_file else weasyprint.HTML(string=source)
+    document.write_pdf(output_path, stylesheets=[stylesheet], font_config=weasyprint_fonts)
+    return output_path
+
+class WeasyPrintRenderer:
+    """
+    Renderiza con WeasyPrint en un pool de procesos que vive toda la ejecución:
+    cada proceso carga la biblioteca y las fuentes una sola vez, en lugar de
+    arrancar un wkhtmltopdf por página. Las opciones de página, encabezado y pie
+    de wkhtmltopdf se traducen a una hoja de estilo @page; el índice (`toc`) no
+    se genera, aunque WeasyPrint añade al PDF marcadores a partir de los títulos.
+    """
+    name = "weasyprint"
+
+    def __init__(self, workers=None):
+        if load_weasyprint() is None:
+            raise RuntimeError("WeasyPrint no está disponible (pip install weasyprint y las bibliotecas de Pango)")
+        self.workers = workers or RENDER_WORKERS
+        self.lock = threading.Lock()
+        self.closed = False
+        self.executor = self._start()
+
+    def _start(self):
+        # "spawn" también en Linux: hacer fork con los hilos del scraper en marcha no es seguro
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=weasyprint_worker_init)
+
+    @staticmethod
+    def css_content(template):
+        parts = []
+        for piece in re.split(r'(\[page\]|\[topage\]|\[section\])', template):
+            if piece in CSS_PAGE_VARIABLES:
+                parts.append(CSS_PAGE_VARIABLES[piece])
+            elif piece:
+                parts.append('"' + piece.replace("\\", "\\\\").replace('"', '\\"') + '"')
+        return " ".join(parts) or '""'
+
+    @classmethod
+    def page_css(cls, options):
+        """
+        Hoja de estilo @page equivalente a las opciones de wkhtmltopdf.
+        """
+        margins = " ".join(options.get(f"margin-{side}", "0") for side in ("top", "right", "bottom", "left"))
+        rules = [f"size: {options.get('page-size', 'A4')}; margin: {margins};"]
+        for box, prefix in (("top-center", "header"), ("bottom-center", "footer")):
+            if f"{prefix}-center" in options:
+                rules.append(f"@{box} {{ content: {cls.css_content(options[f'{prefix}-center'])}; "
+                             f"font-size: {options.get(f'{prefix}-font-size', '9')}pt; }}")
+        css = "@page { " + " ".join(rules) + " }"
+        if "[section]" in options.get("header-center", "") + options.get("footer-center", ""):
+            css += " h1 { string-set: section content(text); }"
+        return css
+
+    def render(self, html_content, output_path, options, toc=None):
+        if isinstance(html_content, SpooledHtml):
+            source, is_file = html_content.path, True
+        else:
+            source, is_file = html_content, False
+        
+        with self.lock:
+            executor = self.executor
+        future = executor.submit(weasyprint_render, source, is_file, os.path.abspath(output_path), self.page_css(options))
+        try:
+            future.result(timeout=RENDER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # Un trabajo en marcha no se puede cancelar: se matan los procesos para
+            # que no sigan ocupados ni escriban el PDF cuando ya se está reintentando
+            self._restart(executor)
+            raise TimeoutError(f"WeasyPrint superó el límite de {RENDER_TIMEOUT} s")
+        except BrokenProcessPool:
+            # Un proceso murió (por ejemplo, sin memoria): se arranca un pool nuevo para los reintentos
+            self._restart(executor)
+            raise IOError("un proceso de WeasyPrint terminó de forma inesperada")
+        except Exception as e:
+            raise IOError(f"WeasyPrint: {str(e)}")
+
+    def _restart(self, executor):
+        """
+        Sustituye el pool `executor` por uno nuevo, si otro hilo no lo ha hecho ya,
+        y termina sus procesos. Los trabajos de otras páginas que estuvieran en él
+        fallan y se reintentan en el pool nuevo.
+        """
+        with self.lock:
+            if self.executor is executor and not self.closed:
+                self.executor = self._start()
+        self._terminate(executor)
+
+    @staticmethod
+    def _terminate(executor):
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            executor = self.executor
+        self._terminate(executor)
+
+RENDERERS = {
+    "wkhtmltopdf": WkhtmltopdfRenderer,
+    "weasyprint": WeasyPrintRenderer,
+}
+
+active_renderer = None
+active_renderer_lock = threading.Lock()
+
+def get_renderer():
+    """
+    Devuelve el backend de renderizado de RENDER_BACKEND, creándolo la primera
+    vez. Así los procesos de WeasyPrint se arrancan una sola vez por ejecución.
+    """
+    global active_renderer
+    with active_renderer_lock:
+        if active_renderer is None or active_renderer.name != RENDER_BACKEND:
+            if active_renderer is not None:
+                active_renderer.close()
+            active_renderer = RENDERERS[RENDER_BACKEND]()
+        return active_renderer
+
+def close_renderer():
+    global active_renderer
+    with active_renderer_lock:
+        if active_renderer is not None:
+            active_renderer.close()
+            active_renderer = None
+
+def render_page(html_content, output_path, options, toc=None):
+    """
+    Renderiza una página con el backend de RENDER_BACKEND, con un tiempo máximo
+    por intento y reintentos si el renderizado falla o no genera el PDF.
+    `html_content` puede ser el HTML o un SpooledHtml que se lee del disco.
+    El PDF se escribe en un archivo temporal y se mueve a `output_path` al
+    terminar, así que dos páginas con el mismo HTML procesado pueden
+    renderizarse a la vez hacia la misma ruta de la caché.
+    """
+    renderer = get_renderer()
+    attempts = RENDER_RETRIES + 1
+    base, extension = os.path.splitext(output_path)
+    tmp_path = f"{base}.{os.getpid()}-{threading.get_ident()}.tmp{extension}"
+    
+    for attempt in range(1, attempts + 1):
+        try:
+            renderer.render(html_content, tmp_path, options, toc)
+            if os.path.exists(tmp_path) and os.path.getsize(tmp_path) > 0:
+                os.replace(tmp_path, output_path)
+                return output_path
+            error = IOError(f"{renderer.name} no generó el archivo {output_path}")
+        except IOError as e:
+            error = e
+        
+        logger.warning(f"Fallo al renderizar {output_path} (intento {attempt}/{attempts}): {str(error)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    raise error
+
+def timed_render(name, html_content, output_path, options, toc=None, profile=None, page_hash=None):
+    """
+    Renderiza con render_page registrando el tiempo, el perfil y el tamaño del PDF generado.
+    """
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Eliminar elementos de navegación y scripts
-        for element in soup(["header", "footer", "nav", "script", "style"]):
-            element.decompose()
-        
-        # Identificar patrón de duplicación específico de la documentación de Bitunix
-        # Buscar patrones como 'curl-X'GET'--...' duplicados
-        curl_examples = soup.find_all(string=lambda text: text and text.strip().startswith('curl-X'))
-        processed_curls = set()
-        
-        for curl_text in curl_examples:
-            # Normalizar el texto del curl para comparar
-            normalized = re.sub(r'\s+', ' ', curl_text.strip())
-            if normalized in processed_curls:
-                # Es un duplicado, eliminar este nodo
-                if curl_text.parent:
-                    curl_text.parent.decompose()
-            else:
-                processed_curls.add(normalized)
-        
-        # Procesar los bloques de código y tablas especiales
-        soup = process_content_containers(soup)
-        
-        # Convertir rutas relativas a absolutas
-        base_url = url.rsplit("/", 1)[0] + "/"
-        for tag in soup.find_all(["img", "link"]):
-            for attr in ["src", "href"]:
-                if tag.get(attr):
-                    tag[attr] = urljoin(base_url, tag[attr])
-        
-        # Mejorar la presentación general del documento
-        # Agregar estilo para mejorar la legibilidad y preservar formato de código
-        style_tag = soup.new_tag('style')
-        style_tag.string = """
-            body { font-family: Arial, sans-serif; line-height: 1.5; }
-            table { border-collapse: collapse; width: 100%; margin: 15px 0; }
-            th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-            th { background-color: #f2f2f2; }
-            h1, h2, h3, h4, h5, h6 { margin-top: 20px; }
-            pre { background-color: #f5f5f5; padding: 10px; border-radius: 4px; overflow-x: auto; white-space: pre-wrap; }
-            code { font-family: monospace; background-color: #f5f5f5; padding: 2px 4px; }
-            .code-example, .request-example, .response-example { 
-                background-color: #f5f5f5; 
-                padding: 10px; 
-                border-radius: 4px; 
-                margin: 10px 0;
-                font-family: monospace;
-                white-space: pre-wrap;
-            }
-        """
-        soup.head.append(style_tag) if soup.head else soup.append(style_tag)
-        
-        return str(soup)
+        with run_stats.measure("render", name) as sample:
+            sample["profile"] = profile
+            render_page(html_content, output_path, options, toc)
+            sample["output_bytes"] = os.path.getsize(output_path)
+    finally:
+        if isinstance(html_content, SpooledHtml):
+            html_content.remove()
+    run_journal.record_page(name, output_path, page_hash)
+    return output_path
+
+def resumed_page(name, site=None, urls=None):
+    """
+    PDF de `name` generado en la ejecución anterior, o None. Su entrada de la caché
+    de renderizado se marca como usada para que prune() no la elimine, y sus páginas
+    (`urls`, por defecto la propia `name`) vuelven al detector de duplicados.
+    """
+    resumed_path = run_journal.completed(name)
+    if resumed_path:
+        cache_key = run_journal.pages[name].get("cache_key")
+        if cache_key:
+            render_cache.restore(cache_key, name)
+        if DUPLICATE_MODE != "off":
+            site = site or SiteConfig.from_globals()
+            for url in urls or [name]:
+                site.duplicates.restore(url, run_journal.fingerprints.get(url))
+    return resumed_path
+
+def render_target(html_content, options, temp_path, toc=None):
+    """
+    Decide dónde se guarda el PDF de un HTML. En modo incremental la ruta es la
+    de la caché de renderizado y, si el PDF ya existe, se reutiliza.
+    Devuelve (ruta, hash, reutilizado).
+    """
+    if not INCREMENTAL_RENDER:
+        return temp_path, None, False
     
-    except Exception as e:
-        logger.error(f"Error procesando {url}: {str(e)}")
-        return None
+    key_options = options if toc is None else dict(options, toc=toc)
+    if RENDER_BACKEND != "wkhtmltopdf":
+        key_options = dict(key_options, renderer=RENDER_BACKEND)
+    page_hash = render_cache.content_hash(html_content, key_options)
+    cached_path = render_cache.get(page_hash)
+    if cached_path:
+        logger.info(f"PDF sin cambios, reutilizado: {cached_path}")
+        return cached_path, page_hash, True
+    return render_cache.path_for(page_hash), page_hash, False
 
-def convert_to_pdf(url_list):
+def page_title(url):
     """
-    Convierte las URLs en archivos PDF individuales y los combina.
+    Nombre de la página que se muestra en el encabezado del PDF.
+    """
+    return url.split('/')[-1].replace('.html', '').replace('%20', ' ')
+
+def submit_render(executor, name, html_content, options, temp_path, toc=None, profile=None):
+    """
+    Programa el renderizado de un HTML o, en modo incremental, reutiliza el PDF
+    de la caché si el contenido no ha cambiado.
+    Devuelve (ruta, future, hash); future es None si el PDF se reutiliza.
+    """
+    output_path, page_hash, reused = render_target(html_content, options, temp_path, toc)
+    if reused:
+        return output_path, None, page_hash
+    # Los trabajos en cola no retienen el HTML en memoria en el modo acotado
+    html_content = spool_if_bounded(html_content, temp_path)
+    return output_path, executor.submit(timed_render, name, html_content, output_path, options, toc, profile, page_hash), page_hash
+
+def collect_renders(jobs):
+    """
+    Espera a los renderizados en el orden original y devuelve las rutas de los PDFs generados.
     """
     pdf_files = []
-    
-    for idx, url in enumerate(url_list, 1):
+    for name, output_path, future, page_hash in jobs:
         try:
-            logger.info(f"Procesando ({idx}/{len(url_list)}): {url}")
-            html_content = process_html(url)
-            
-            if html_content:
-                output_path = os.path.join(TEMP_DIR, f"page_{idx}.pdf")
+            if future:
+                future.result()
+                if page_hash:
+                    render_cache.add(page_hash, name)
+                logger.info(f"PDF creado: {output_path}")
+            pdf_files.append(output_path)
+        
+        except Exception as e:
+            logger.error(f"Error crítico al procesar {name}: {str(e)}")
+    return pdf_files
+
+def convert_to_pdf(url_list, workers=None, on_page_ready=None, site=None, executor=None):
+    """
+    Convierte las URLs en archivos PDF individuales y los combina.
+    En modo incremental reutiliza los PDFs de las páginas cuyo HTML procesado no ha cambiado.
+    El renderizado se reparte entre varios procesos de wkhtmltopdf, pero la lista
+    devuelta conserva el orden de las URLs.
+    Si se indica `on_page_ready(posición, ruta)`, se llama en cuanto termina cada
+    página (en cualquier orden), con ruta None si la página no se pudo convertir.
+    Con `executor`, los renderizados van a ese pool compartido.
+    """
+    site = site or SiteConfig.from_globals()
+    workers = workers or RENDER_WORKERS
+    jobs = []
+    
+    def notify(position, path):
+        if on_page_ready:
+            on_page_ready(position, path)
+    
+    def render_done(position, path, future):
+        notify(position, None if future.exception() else path)
+    
+    with (ThreadPoolExecutor(max_workers=workers) if executor is None else contextlib.nullcontext(executor)) as executor:
+        for idx, url in enumerate(url_list, 1):
+            try:
+                resumed_path = resumed_page(url, site)
+                if resumed_path:
+                    logger.info(f"Ya convertida en la ejecución anterior ({idx}/{len(url_list)}): {url}")
+                    notify(idx, resumed_path)
+                    jobs.append((url, resumed_path, None, None))
+                    continue
                 
-                # Obtener el nombre de la página para usarlo como encabezado
-                page_name = url.split('/')[-1].replace('.html', '').replace('%20', ' ')
+                logger.info(f"Procesando ({idx}/{len(url_list)}): {url}")
+                html_content = process_html(url, site)
                 
-                pdfkit.from_string(
-                    html_content,
-                    output_path,
-                    configuration=config,
-                    options={
-                        "encoding": "UTF-8",
-                        "page-size": "A4",
-                        "margin-top": "20mm",
-                        "margin-right": "15mm",
-                        "margin-bottom": "20mm",
-                        "margin-left": "15mm",
-                        "enable-local-file-access": "",
-                        "quiet": "",
-                        # Opciones para mejorar la legibilidad
-                        "print-media-type": "",
-                        "no-background": "",
-                        # Agregar encabezado y pie de página
-                        "header-center": page_name,
-                        "header-font-size": "9",
-                        "header-spacing": "5",
-                        "footer-center": f"Página [page] de [topage]",
-                        "footer-font-size": "8",
-                        # Ajustes para mejorar la presentación de las tablas
-                        "dpi": "300",
-                        # Ajuste para asegurar que se muestren todos los contenidos
-                        "javascript-delay": "1000",
-                        # Opciones para preservar formato de código
-                        "enable-smart-shrinking": "",
-                    }
-                )
-                pdf_files.append(output_path)
-                logger.info(f"PDF creado: {output_path}")
+                if html_content:
+                    # Obtener el nombre de la página para usarlo como encabezado
+                    profile = resolve_render_profile(html_content)
+                    options = build_pdf_options(page_title(url), profile)
+                    temp_path = os.path.join(site.temp_dir, f"page_{idx}.pdf")
+                    
+                    output_path, future, page_hash = submit_render(
+                        executor, url, html_content, options, temp_path, profile=profile)
+                    if future:
+                        future.add_done_callback(functools.partial(render_done, idx, output_path))
+                    else:
+                        notify(idx, output_path)
+                    jobs.append((url, output_path, future, page_hash))
+                else:
+                    notify(idx, None)
+            
+            except Exception as e:
+                logger.error(f"Error crítico al procesar {url}: {str(e)}")
+                notify(idx, None)
         
+        # Recogemos los resultados en el orden original de las URLs
+        return collect_renders(jobs)
+
+def page_anchor(url, base_domain=None):
+    """
+    Identificador del ancla de una página dentro del documento único.
+    """
+    base_domain = canonicalize_url(base_domain or BASE_DOMAIN)
+    path = unquote(url[len(base_domain):] if url.startswith(base_domain) else urlparse(url).path)
+    return "page-" + re.sub(r'[^A-Za-z0-9_-]+', '-', path.replace('.html', '')).strip('-')
+
+def build_document_html(url_list, site=None):
+    """
+    Une el HTML procesado de varias páginas en un único documento. Cada página va
+    en su propia sección con un ancla y un salto de página, y los enlaces entre
+    páginas del documento se convierten en enlaces internos.
+    Devuelve el HTML y el número de páginas incluidas.
+    """
+    site = site or SiteConfig.from_globals()
+    anchors = {url: page_anchor(url, site.base_domain) for url in url_list}
+    head_tags = []
+    seen_head_tags = set()
+    sections = []
+    
+    for url in url_list:
+        try:
+            soup = process_page(url, site)
         except Exception as e:
-            logger.error(f"Error crítico al procesar {url}: {str(e)}")
+            logger.error(f"Error procesando {url}: {str(e)}")
+            continue
+        if soup is None:
+            continue
+        
+        # Estilos y hojas de estilo de todas las páginas, sin repetir
+        if soup.head:
+            for tag in soup.head.find_all(["style", "link"]):
+                markup = str(tag)
+                if markup not in seen_head_tags:
+                    seen_head_tags.add(markup)
+                    head_tags.append(markup)
+            soup.head.decompose()
+        
+        body = soup.body or soup
+        for link in body.find_all("a", href=True):
+            if link["href"].startswith("#"):
+                continue
+            target = urljoin(url, link["href"])
+            canonical = canonicalize_url(target)
+            link["href"] = "#" + anchors[canonical] if canonical in anchors else target
+        
+        page_break = ' style="page-break-before: always;"' if sections else ""
+        sections.append(f'<div class="doc-page" id="{anchors[url]}"{page_break}>{body.decode_contents()}</div>')
+        if MEMORY_BOUNDED:
+            soup.decompose()
+    
+    html_content = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">' + "".join(head_tags) +
+        "</head><body>" + "".join(sections) + "</body></html>"
+    )
+    return html_content, len(sections)
 
-    return pdf_files
+def convert_to_pdf_document(url_list, batch_size=None, workers=None, site=None, executor=None):
+    """
+    Modo documento único: concatena el HTML procesado de todas las páginas y lo
+    renderiza con una sola llamada a wkhtmltopdf (o una por lote si se indica
+    `batch_size`), evitando el arranque de wkhtmltopdf y la espera de JavaScript
+    por cada página. Devuelve las rutas de los PDFs de cada lote, en orden.
+    """
+    site = site or SiteConfig.from_globals()
+    batch_size = batch_size or RENDER_BATCH_SIZE or len(url_list)
+    batches = [url_list[i:i + batch_size] for i in range(0, len(url_list), batch_size)]
+    
+    toc = None
+    if RENDER_TOC:
+        if len(batches) == 1:
+            toc = {"toc-header-text": "Índice"}
+        else:
+            logger.warning("El índice solo se genera cuando el documento se renderiza en un único lote")
+    
+    jobs = []
+    pool = ThreadPoolExecutor(max_workers=workers or RENDER_WORKERS) if executor is None else contextlib.nullcontext(executor)
+    with pool as executor:
+        for number, batch in enumerate(batches, 1):
+            name = f"lote {number}" if site.name == "default" else f"{site.name} lote {number}"
+            resumed_path = resumed_page(name, site, batch)
+            if resumed_path:
+                logger.info(f"Lote {number}/{len(batches)} ya convertido en la ejecución anterior")
+                jobs.append((name, resumed_path, None, None))
+                continue
+            
+            logger.info(f"Preparando lote {number}/{len(batches)} ({len(batch)} páginas)")
+            html_content, included = build_document_html(batch, site)
+            if not included:
+                continue
+            
+            # El encabezado muestra el título de la sección actual
+            profile = resolve_render_profile(html_content)
+            options = build_pdf_options("[section]", profile)
+            temp_path = os.path.join(site.temp_dir, f"batch_{number}.pdf")
+            output_path, future, page_hash = submit_render(
+                executor, name, html_content, options, temp_path, toc, profile)
+            jobs.append((name, output_path, future, page_hash))
+        
+        return collect_renders(jobs)
+
+PIPELINE_DONE = object()  # Marca de fin de trabajo en las colas del pipeline
+
+def run_pipeline(seed_url, workers=None, site=None, executor=None):
+    """
+    Ejecuta crawling, procesamiento y renderizado de forma simultánea: cada URL
+    descubierta pasa a la cola de procesamiento y cada HTML limpio a la de
+    renderizado, así que las páginas se convierten mientras el crawling continúa.
+    Las colas son acotadas para que una etapa rápida no acumule trabajo sin límite.
+    El orden del documento solo se conoce al terminar el crawling, por lo que se
+    aplica al final. Devuelve (URLs ordenadas, PDFs en ese mismo orden).
+    Con `executor`, los renderizados van a ese pool compartido.
+    """
+    site = site or SiteConfig.from_globals()
+    workers = workers or RENDER_WORKERS
+    process_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    render_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    crawled_urls = []
+    rendered = {}
+    rendered_lock = threading.Lock()
+    page_numbers = itertools.count(1)
+    
+    def found(url):
+        # Los duplicados se deciden en el orden del crawling, no en el de los hilos
+        if DUPLICATE_MODE != "off":
+            site.duplicates.expect(url)
+        process_queue.put(url)
+    
+    def crawl():
+        try:
+            crawled_urls.extend(discover_urls(seed_url, on_url_found=found, site=site, executor=site.fetch_executor))
+        except Exception as e:
+            logger.error(f"Error en crawling: {str(e)}")
+        finally:
+            for _ in range(PIPELINE_PROCESS_WORKERS):
+                process_queue.put(PIPELINE_DONE)
+    
+    def process():
+        while True:
+            url = process_queue.get()
+            if url is PIPELINE_DONE:
+                return
+            try:
+                resumed_path = resumed_page(url, site)
+                if resumed_path:
+                    logger.info(f"Ya convertida en la ejecución anterior: {url}")
+                    with rendered_lock:
+                        rendered[url] = resumed_path
+                    continue
+                logger.info(f"Procesando: {url}")
+                html_content = process_html(url, site)
+            except Exception as e:
+                # Un error no debe parar el hilo: el crawling quedaría bloqueado en la cola llena
+                logger.error(f"Error crítico al procesar {url}: {str(e)}")
+                continue
+            finally:
+                # Si la página no llegó al detector, no debe bloquear a las siguientes
+                site.duplicates.release(url)
+            if html_content:
+                render_queue.put((url, html_content))
+    
+    def render_one(url, html_content):
+        profile = resolve_render_profile(html_content)
+        options = build_pdf_options(page_title(url), profile)
+        temp_path = os.path.join(site.temp_dir, f"page_{next(page_numbers)}.pdf")
+        output_path, page_hash, reused = render_target(html_content, options, temp_path)
+        if not reused:
+            html_content = spool_if_bounded(html_content, temp_path)
+            timed_render(url, html_content, output_path, options, profile=profile, page_hash=page_hash)
+            if page_hash:
+                render_cache.add(page_hash, url)
+            logger.info(f"PDF creado: {output_path}")
+        return output_path
+    
+    def render():
+        while True:
+            item = render_queue.get()
+            if item is PIPELINE_DONE:
+                return
+            url, html_content = item
+            try:
+                if executor is None:
+                    output_path = render_one(url, html_content)
+                else:
+                    output_path = executor.submit(render_one, url, html_content).result()
+                with rendered_lock:
+                    rendered[url] = output_path
+            
+            except Exception as e:
+                logger.error(f"Error crítico al procesar {url}: {str(e)}")
+    
+    crawler = threading.Thread(target=crawl, daemon=True)
+    processors = [threading.Thread(target=process, daemon=True) for _ in range(PIPELINE_PROCESS_WORKERS)]
+    renderers = [threading.Thread(target=render, daemon=True) for _ in range(workers)]
+    for thread in [crawler] + processors + renderers:
+        thread.start()
+    
+    crawler.join()
+    for thread in processors:
+        thread.join()
+    for _ in renderers:
+        render_queue.put(PIPELINE_DONE)
+    for thread in renderers:
+        thread.join()
+    
+    urls = order_document_urls(crawled_urls, site)
+    run_journal.record_urls(crawled_urls, urls)
+    return urls, [rendered[url] for url in urls if url in rendered]
 
 def merge_pdfs(pdf_files, output_file):
     """
@@ -625,26 +2924,456 @@ def merge_pdfs(pdf_files, output_file):
         return False
     
     try:
-        merger = PdfMerger()
-        for pdf_file in pdf_files:
-            merger.append(pdf_file)
-        
-        merger.write(output_file)
-        merger.close()
+        with run_stats.measure("merge_pdfs"):
+            merger = PdfMerger()
+            for pdf_file in pdf_files:
+                merger.append(pdf_file)
+            
+            merger.write(output_file)
+            merger.close()
         logger.info(f"PDF combinado creado: {output_file}")
+        if MERGE_DEDUP or MERGE_RECOMPRESS:
+            optimize_pdf(output_file)
         return True
     
     except Exception as e:
         logger.error(f"Error al combinar PDFs: {str(e)}")
         return False
 
-def cleanup(pdf_files, temp_dir):
+class StreamingPdfWriter:
+    """
+    Escribe el PDF combinado de forma incremental. Cada fragmento se copia objeto
+    a objeto al archivo de salida en cuanto se añade, así que en memoria solo
+    quedan las posiciones de los objetos escritos y las referencias a las páginas,
+    sin importar cuántos fragmentos se combinen.
+    Los marcadores (outline) de cada fragmento se encadenan en un único índice y
+    los destinos con nombre se sustituyen por destinos explícitos, para que no
+    choquen los nombres de fragmentos distintos.
+    Con `dedup`, los recursos de página idénticos (fuentes, imágenes, estados
+    gráficos) se escriben una sola vez aunque aparezcan en varios fragmentos.
+    """
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    OUTLINES_ID = 3
+
+    def __init__(self, output_file, dedup=None, recompress=None):
+        self.output_file = output_file
+        self.dedup = MERGE_DEDUP if dedup is None else dedup
+        self.recompress = MERGE_RECOMPRESS if recompress is None else recompress
+        # Hash de contenido -> identificador del objeto ya escrito
+        self.shared_objects = {}
+        self.object_hashes = {}
+        self.deduplicated = 0
+        self.input_bytes = 0
+        self.stream = open(output_file, "wb")
+        self.stream.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = {}
+        self.next_id = self.OUTLINES_ID + 1
+        self.page_ids = []
+        self.fragments = 0
+        self.named_destinations = {}
+        # Marcadores de primer nivel: primero, último (pendiente de escribir) y total
+        self.first_outline = None
+        self.last_outline = None
+        self.pending_outline = None
+        self.outline_count = 0
+        # Entradas del catálogo y del trailer copiadas con append(document=True)
+        self.catalog_entries = {}
+        self.trailer_entries = {}
+
+    def _allocate(self):
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    def _write_object(self, obj_id, obj):
+        self.offsets[obj_id] = self.stream.tell()
+        self.stream.write(f"{obj_id} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(self.stream, None)
+        self.stream.write(b"\nendobj\n")
+
+    def _convert(self, obj, reader, mapping, queue):
+        """
+        Copia un objeto directo sustituyendo sus referencias por los nuevos
+        identificadores; los objetos referenciados se encolan para copiarlos después.
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in mapping:
+                digest = self.object_hashes.get(key)
+                if digest in self.shared_objects:
+                    # Idéntico a un objeto ya escrito (con todo lo que referencia)
+                    mapping[key] = self.shared_objects[digest]
+                    self.deduplicated += 1
+                    return IndirectObject(mapping[key], 0, None)
+                mapping[key] = self._allocate()
+                if digest:
+                    self.shared_objects[digest] = mapping[key]
+                queue.append(key)
+            return IndirectObject(mapping[key], 0, None)
+        
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+        elif isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+        elif isinstance(obj, ArrayObject):
+            return ArrayObject(self._convert(item, reader, mapping, queue) for item in obj)
+        else:
+            return obj
+        
+        for name, value in obj.items():
+            if isinstance(obj, StreamObject) and name == "/Length":
+                continue
+            # Destinos con nombre (en enlaces, acciones GoTo y marcadores)
+            if name in ("/Dest", "/D") and isinstance(value, str) and value in self.named_destinations:
+                value = self.named_destinations[value]
+            copy[NameObject(name)] = self._convert(value, reader, mapping, queue)
+        if isinstance(copy, StreamObject) and self.recompress:
+            self._recompress(copy)
+        return copy
+
+    @staticmethod
+    def _recompress(stream):
+        """
+        Comprime con el nivel máximo de zlib los streams sin filtro o con FlateDecode
+        sin parámetros, si así ocupan menos.
+        """
+        filters = stream.get("/Filter")
+        try:
+            if filters is None:
+                compressed = zlib.compress(stream._data, 9)
+                if len(compressed) < len(stream._data):
+                    stream._data = compressed
+                    stream[NameObject("/Filter")] = NameObject("/FlateDecode")
+            elif filters == "/FlateDecode" and "/DecodeParms" not in stream:
+                compressed = zlib.compress(zlib.decompress(stream._data), 9)
+                if len(compressed) < len(stream._data):
+                    stream._data = compressed
+        except zlib.error:
+            pass
+
+    def _hash_resources(self, reader, pages):
+        """
+        Calcula un hash de Merkle para cada objeto alcanzable desde los recursos de
+        las páginas: el contenido del objeto con cada referencia sustituida por el
+        hash del objeto referenciado. Los objetos que forman ciclos, que apuntan a
+        páginas o que usan destinos con nombre no reciben hash y no se comparten.
+        """
+        hashes = {}
+        in_progress = set()
+        
+        def serialize(value, depth):
+            if isinstance(value, IndirectObject):
+                key = (value.idnum, value.generation)
+                if key in in_progress or depth > 64:
+                    return None
+                if key not in hashes:
+                    in_progress.add(key)
+                    content = serialize(value.get_object(), depth + 1)
+                    in_progress.discard(key)
+                    hashes[key] = hashlib.sha256(content).digest() if content is not None else None
+                return None if hashes[key] is None else b"R" + hashes[key]
+            
+            if isinstance(value, DictionaryObject):
+                if value.get("/Type") in ("/Page", "/Pages") or "/Parent" in value or "/P" in value:
+                    return None
+                if any(isinstance(value.raw_get(name), str) for name in ("/Dest", "/D") if name in value):
+                    return None
+                parts = [b"S" if isinstance(value, StreamObject) else b"D"]
+                for name in sorted(value):
+                    if name == "/Length" and isinstance(value, StreamObject):
+                        continue
+                    item = serialize(value.raw_get(name), depth + 1)
+                    if item is None:
+                        return None
+                    parts += [name.encode("utf-8"), item]
+                if isinstance(value, StreamObject):
+                    parts.append(hashlib.sha256(value._data).digest())
+            elif isinstance(value, ArrayObject):
+                parts = [b"A"]
+                for item in value:
+                    item = serialize(item, depth + 1)
+                    if item is None:
+                        return None
+                    parts.append(item)
+            else:
+                buffer = io.BytesIO()
+                value.write_to_stream(buffer, None)
+                return type(value).__name__.encode("ascii") + b":" + buffer.getvalue()
+            
+            # Cada parte va precedida de su longitud para que la concatenación no sea ambigua
+            return b"".join(len(part).to_bytes(4, "big") + part for part in parts)
+        
+        for page in pages:
+            page = self._page_with_inherited(page)
+            if "/Resources" in page:
+                serialize(page.raw_get("/Resources"), 0)
+        return {key: digest for key, digest in hashes.items() if digest}
+
+    @staticmethod
+    def _read_named_destinations(reader):
+        """
+        Lee los destinos con nombre de un fragmento (árbol /Names /Dests y diccionario /Dests).
+        """
+        destinations = {}
+        
+        def visit(node):
+            node = node.get_object()
+            names = node.get("/Names")
+            if names is not None:
+                names = names.get_object()
+                for i in range(0, len(names) - 1, 2):
+                    destinations[str(names[i].get_object())] = names[i + 1]
+            for kid in node.get("/Kids", ArrayObject()).get_object():
+                visit(kid)
+        
+        root = reader.trailer["/Root"]
+        if "/Names" in root and "/Dests" in root["/Names"]:
+            visit(root["/Names"]["/Dests"])
+        if "/Dests" in root:
+            for name, dest in root["/Dests"].items():
+                destinations[str(name)[1:]] = dest
+        
+        # Un destino puede ser un diccionario con la clave /D
+        for name, dest in destinations.items():
+            resolved = dest.get_object()
+            if isinstance(resolved, DictionaryObject):
+                destinations[name] = resolved.raw_get("/D")
+        return destinations
+
+    def _page_with_inherited(self, page):
+        """
+        Devuelve la página con los atributos heredados de su árbol original y
+        colgada del árbol de páginas del documento combinado.
+        """
+        page = DictionaryObject(page)
+        parent = page.get("/Parent")
+        while parent is not None:
+            parent = parent.get_object()
+            for name in ("/Resources", "/MediaBox", "/CropBox", "/Rotate"):
+                if name not in page and name in parent:
+                    page[NameObject(name)] = parent.raw_get(name)
+            parent = parent.get("/Parent")
+        page[NameObject("/Parent")] = IndirectObject(self.PAGES_ID, 0, None)
+        return page
+
+    def append(self, pdf_file, document=False):
+        """
+        Añade las páginas y los marcadores de un fragmento. Con `document`, copia
+        también el resto de su catálogo (etiquetas de página, nombres, preferencias
+        del visor...) y su /Info y /ID; lo usa optimize_pdf, que reescribe un único PDF.
+        """
+        self.input_bytes += os.path.getsize(pdf_file)
+        with run_stats.measure("merge_append"), open(pdf_file, "rb") as f:
+            reader = PdfReader(f)
+            self.named_destinations = self._read_named_destinations(reader)
+            self.object_hashes = self._hash_resources(reader, reader.pages) if self.dedup else {}
+            mapping = {}
+            queue = deque()
+            page_keys = set()
+            
+            for page in reader.pages:
+                ref = page.indirect_reference
+                key = (ref.idnum, ref.generation)
+                page_keys.add(key)
+                self.page_ids.append(self._convert(ref, reader, mapping, queue).idnum)
+            
+            outlines = reader.trailer["/Root"].get("/Outlines")
+            top_level = []
+            if isinstance(outlines, IndirectObject):
+                # La raíz de marcadores del fragmento pasa a ser la del documento combinado
+                mapping[(outlines.idnum, outlines.generation)] = self.OUTLINES_ID
+                item = outlines.get_object().get("/First")
+                while item is not None:
+                    top_level.append((item.idnum, item.generation))
+                    item = item.get_object().get("/Next")
+            first_key = top_level[0] if top_level else None
+            last_key = top_level[-1] if top_level else None
+            if first_key:
+                self._convert(IndirectObject(*first_key, reader), reader, mapping, queue)
+            
+            if document:
+                root = reader.trailer["/Root"]
+                for name in root:
+                    if name not in ("/Type", "/Pages", "/Outlines"):
+                        self.catalog_entries[name] = self._convert(root.raw_get(name), reader, mapping, queue)
+                for name in ("/Info", "/ID"):
+                    if name in reader.trailer:
+                        self.trailer_entries[name] = self._convert(reader.trailer.raw_get(name), reader, mapping, queue)
+            
+            while queue:
+                key = queue.popleft()
+                obj = reader.get_object(IndirectObject(key[0], key[1], reader))
+                if key in page_keys:
+                    obj = self._page_with_inherited(obj)
+                copy = self._convert(obj, reader, mapping, queue)
+                
+                if key == first_key:
+                    if self.pending_outline:
+                        # Enlazamos con el último marcador del fragmento anterior
+                        prev_id, prev_item = self.pending_outline
+                        prev_item[NameObject("/Next")] = IndirectObject(mapping[key], 0, None)
+                        copy[NameObject("/Prev")] = IndirectObject(prev_id, 0, None)
+                        self._write_object(prev_id, prev_item)
+                        self.pending_outline = None
+                    else:
+                        self.first_outline = mapping[key]
+                if key == last_key:
+                    # Se escribe al llegar el siguiente fragmento o al cerrar
+                    self.pending_outline = (mapping[key], copy)
+                    self.last_outline = mapping[key]
+                    continue
+                self._write_object(mapping[key], copy)
+            
+            self.outline_count += len(top_level)
+        self.fragments += 1
+
+    def close(self):
+        if self.pending_outline:
+            self._write_object(*self.pending_outline)
+            self.pending_outline = None
+        
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(i, 0, None) for i in self.page_ids),
+            NameObject("/Count"): NumberObject(len(self.page_ids)),
+        })
+        self._write_object(self.PAGES_ID, pages)
+        
+        catalog = DictionaryObject({NameObject(name): value for name, value in self.catalog_entries.items()})
+        catalog[NameObject("/Type")] = NameObject("/Catalog")
+        catalog[NameObject("/Pages")] = IndirectObject(self.PAGES_ID, 0, None)
+        if self.first_outline:
+            outlines = DictionaryObject({
+                NameObject("/Type"): NameObject("/Outlines"),
+                NameObject("/First"): IndirectObject(self.first_outline, 0, None),
+                NameObject("/Last"): IndirectObject(self.last_outline, 0, None),
+                NameObject("/Count"): NumberObject(self.outline_count),
+            })
+            self._write_object(self.OUTLINES_ID, outlines)
+            catalog[NameObject("/Outlines")] = IndirectObject(self.OUTLINES_ID, 0, None)
+        self._write_object(self.CATALOG_ID, catalog)
+        
+        # Tabla de referencias cruzadas y trailer
+        xref_offset = self.stream.tell()
+        size = self.next_id
+        self.stream.write(f"xref\n0 {size}\n".encode("ascii"))
+        self.stream.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, size):
+            if obj_id in self.offsets:
+                self.stream.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode("ascii"))
+            else:
+                self.stream.write(b"0000000000 65535 f \n")
+        trailer = DictionaryObject({NameObject(name): value for name, value in self.trailer_entries.items()})
+        trailer[NameObject("/Size")] = NumberObject(size)
+        trailer[NameObject("/Root")] = IndirectObject(self.CATALOG_ID, 0, None)
+        self.stream.write(b"trailer\n")
+        trailer.write_to_stream(self.stream, None)
+        self.stream.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self.stream.close()
+        
+        output_bytes = os.path.getsize(self.output_file)
+        logger.info(
+            f"PDF combinado: {output_bytes / 2 ** 20:.2f} MB "
+            f"(fragmentos: {self.input_bytes / 2 ** 20:.2f} MB, {self.deduplicated} objetos compartidos)"
+        )
+        run_stats.note("merge_size", {
+            "input_bytes": self.input_bytes,
+            "output_bytes": output_bytes,
+            "shared_objects": self.deduplicated,
+        })
+
+class OrderedPdfAssembler:
+    """
+    Recibe los PDFs de página en el orden en que terminan de renderizarse y los
+    añade al StreamingPdfWriter en el orden del documento, guardando solo las
+    rutas de los que llegan adelantados.
+    """
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.next_position = 1
+        self.failed = False
+
+    def add(self, position, pdf_file):
+        with self.lock:
+            self.pending[position] = pdf_file
+            while self.next_position in self.pending:
+                ready = self.pending.pop(self.next_position)
+                self.next_position += 1
+                if ready and not self.failed:
+                    try:
+                        self.writer.append(ready)
+                    except Exception as e:
+                        logger.error(f"Error al añadir {ready} al PDF combinado: {str(e)}")
+                        self.failed = True
+
+    def close(self):
+        """
+        Añade los fragmentos que queden pendientes y cierra el PDF combinado.
+        """
+        with self.lock:
+            for position in sorted(self.pending):
+                ready = self.pending.pop(position)
+                if ready and not self.failed:
+                    self.writer.append(ready)
+            self.writer.close()
+            
+            if self.failed or not self.writer.page_ids:
+                logger.error("No se pudo generar el PDF combinado de forma incremental")
+                return False
+            logger.info(f"PDF combinado creado: {self.writer.output_file}")
+            return True
+
+def merge_pdfs_streaming(pdf_files, output_file):
+    """
+    Combina varios archivos PDF escribiendo el resultado de forma incremental.
+    """
+    if not pdf_files:
+        logger.error("No hay archivos PDF para combinar")
+        return False
+    
+    assembler = OrderedPdfAssembler(StreamingPdfWriter(output_file))
+    for position, pdf_file in enumerate(pdf_files, 1):
+        assembler.add(position, pdf_file)
+    return assembler.close()
+
+def optimize_pdf(pdf_file):
+    """
+    Reescribe un PDF ya combinado con StreamingPdfWriter para compartir los recursos
+    repetidos y, si está activado, recomprimir los streams. Se conservan el catálogo
+    y la información del documento. El original solo se sustituye si el resultado
+    ocupa menos.
+    """
+    optimized_file = pdf_file + ".opt"
+    try:
+        with run_stats.measure("merge_optimize"):
+            writer = StreamingPdfWriter(optimized_file)
+            writer.append(pdf_file, document=True)
+            writer.close()
+        if os.path.getsize(optimized_file) < os.path.getsize(pdf_file):
+            os.replace(optimized_file, pdf_file)
+            return True
+        os.remove(optimized_file)
+        logger.info("La optimización no reduce el tamaño del PDF; se conserva el original")
+    except Exception as e:
+        logger.error(f"Error al optimizar {pdf_file}: {str(e)}")
+        if os.path.exists(optimized_file):
+            os.remove(optimized_file)
+    return False
+
+def cleanup(pdf_files, temp_dir, clear_pages=True):
     """
-    Limpia los archivos temporales.
+    Limpia los archivos temporales. Los PDFs de la caché de renderizado se conservan.
     """
     try:
         for f in pdf_files:
-            os.remove(f)
+            if os.path.dirname(os.path.abspath(f)) == os.path.abspath(temp_dir):
+                os.remove(f)
+        if clear_pages:
+            page_store.clear()
         os.rmdir(temp_dir)
         logger.info("Limpieza de archivos temporales completada")
     except Exception as e:
@@ -656,8 +3385,7 @@ def parse_navigation_structure(url):
     Esta función es una alternativa que intenta encontrar un índice o mapa del sitio.
     """
     try:
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        soup = BeautifulSoup(response.content, "html.parser")
+        soup = make_soup(fetch_page(url))
         
         # Buscar elementos que suelen contener la tabla de contenidos
         toc_candidates = [
@@ -677,8 +3405,8 @@ def parse_navigation_structure(url):
             urls = []
             for link in links:
                 href = link['href']
-                abs_url = urljoin(url, href)
-                if abs_url.startswith(BASE_DOMAIN) and abs_url.endswith('.html'):
+                abs_url = canonicalize_url(urljoin(url, href))
+                if abs_url.startswith(canonicalize_url(BASE_DOMAIN)) and abs_url.endswith('.html'):
                     urls.append(abs_url)
             
             logger.info(f"Estructura de navegación encontrada con {len(urls)} enlaces")
@@ -690,175 +3418,513 @@ def parse_navigation_structure(url):
         logger.error(f"Error al analizar estructura de navegación: {str(e)}")
         return []
 
-def order_urls_by_structure(urls):
+class UrlOrdering:
+    """
+    Motor de ordenación de URLs. SECTION_ORDER, SUBSECTION_ORDER y
+    SPECIFIC_FILE_ORDER se compilan una vez en diccionarios de rangos, cada URL
+    recibe una tupla de rangos como clave y todo se ordena con una única llamada
+    a sorted(), en lugar de recorrer las listas de configuración por cada URL.
+    """
+    def __init__(self, section_order, subsection_order, specific_file_order):
+        self.sections = list(section_order)
+        self.section_rank = {section: rank for rank, section in enumerate(section_order)}
+        self.other_rank = len(section_order)
+        self.subsections = {section: list(subsections) for section, subsections in subsection_order.items()}
+        self.directories = {}
+        self.subsection_rank = {
+            section: {subsection: rank for rank, subsection in enumerate(subsections)}
+            for section, subsections in subsection_order.items()
+        }
+        # Grupo -> nombre de archivo -> posiciones fijas (un nombre puede repetirse)
+        self.file_rank = {}
+        self.file_pins = {}
+        for group, file_names in specific_file_order.items():
+            ranks = self.file_rank[group] = {}
+            for rank, file_name in enumerate(file_names):
+                ranks.setdefault(file_name, []).append(rank)
+            self.file_pins[group] = len(file_names)
+
+    def _pin(self, group, url, used):
+        """
+        Posición fija de la URL dentro de su grupo, o None. Cada posición se asigna
+        a la primera URL (en el orden de entrada) cuyo nombre de archivo coincide.
+        """
+        ranks = self.file_rank[group]
+        path = unquote(url)
+        file_name = path.rsplit("/", 1)[-1]
+        candidates = [file_name] if file_name in ranks else []
+        # Nombres con subdirectorio: se comparan por el final de la ruta
+        candidates += [name for name in ranks if "/" in name and path.endswith(f"/{name}")]
+        for name in candidates:
+            taken = used.get((group, name), 0)
+            if taken < len(ranks[name]):
+                used[(group, name)] = taken + 1
+                return ranks[name][taken]
+        return None
+
+    def _classify(self, directory):
+        """
+        Clasifica un directorio: prefijo de la clave (sección, subsección), grupo
+        de SPECIFIC_FILE_ORDER al que pertenecen sus archivos y si el resto de
+        archivos se ordena por nombre o se deja en el orden de entrada.
+        """
+        interior = directory.split("/")[1:]
+        # Sección: la primera de SECTION_ORDER que aparece como directorio en la URL
+        section_ranks = [self.section_rank[part] for part in interior if part in self.section_rank]
+        if not section_ranks:
+            return (self.other_rank, 0), None, True
+        section_rank = min(section_ranks)
+        section = self.sections[section_rank]
+        
+        subsections = self.subsection_rank.get(section)
+        if subsections is None:
+            # Sin subsecciones: solo las secciones con orden de archivos se ordenan por nombre
+            return (section_rank, 0), section, section in self.file_rank
+        
+        subsection_ranks = [
+            subsections[interior[i + 1]] for i in range(len(interior) - 1)
+            if interior[i] == section and interior[i + 1] in subsections
+        ]
+        if subsection_ranks:
+            subsection_rank = min(subsection_ranks)
+            return (section_rank, subsection_rank), f"{section}/{self.subsections[section][subsection_rank]}", True
+        if interior[-1] == section:
+            # Archivos directamente en la sección, después de todas las subsecciones
+            return (section_rank, len(subsections) + 1), section, True
+        # Subsecciones no configuradas, tras las configuradas
+        return (section_rank, len(subsections)), None, True
+
+    def key(self, url, index, used):
+        directory = url.rpartition("/")[0]
+        info = self.directories.get(directory)
+        if info is None:
+            info = self.directories[directory] = self._classify(directory)
+        prefix, group, sort_by_name = info
+        
+        # Primero los archivos con posición fija; después el resto, por URL o en el orden de entrada
+        if group in self.file_rank:
+            pin = self._pin(group, url, used)
+            if pin is not None:
+                return prefix + (pin, "")
+        rest = self.file_pins.get(group, 0)
+        return prefix + ((rest, url) if sort_by_name else (rest, index))
+
+    def order(self, urls, reference_urls=()):
+        """
+        Ordena las URLs por estructura. Las de `reference_urls` que estén en la
+        lista van delante, en ese orden y sin repetirse.
+        """
+        reference_rank = {}
+        for url in reference_urls:
+            reference_rank.setdefault(url, len(reference_rank))
+        
+        used = {}
+        keyed = []
+        placed_references = set()
+        for index, url in enumerate(urls):
+            if url in reference_rank:
+                if url not in placed_references:
+                    placed_references.add(url)
+                    keyed.append(((0, reference_rank[url]), url))
+                continue
+            keyed.append(((1,) + self.key(url, index, used), url))
+        
+        return [url for _, url in sorted(keyed)]
+
+def order_urls_by_structure(urls, site=None):
     """
     Ordena las URLs según la estructura de secciones, subsecciones y archivos específicos definidos.
     """
-    if not urls:
-        return []
+    return (site or SiteConfig.from_globals()).ordering().order(urls)
+
+def order_document_urls(crawled_urls, site=None):
+    """
+    Orden final del documento: la estructura de secciones y, al principio, las
+    páginas de REFERENCE_ORDER que se hayan encontrado.
+    """
+    site = site or SiteConfig.from_globals()
+    crawled_set = set(crawled_urls)
+    reference_urls = [url for url in map(canonicalize_url, site.reference_order) if url in crawled_set]
+    return site.ordering().order(crawled_urls, reference_urls)
+
+def load_jobs(path):
+    """
+    Lee el archivo de trabajos del modo batch, en YAML o JSON: una lista de sitios
+    o un objeto con `sites` y, opcionalmente, `defaults` comunes a todos ellos.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        if yaml is None:
+            raise RuntimeError("Para leer trabajos en YAML hace falta PyYAML (pip install pyyaml)")
+        jobs = yaml.safe_load(text)
+    else:
+        jobs = json.loads(text)
     
-    # Dividir URLs por secciones
-    sections = {}
-    for section in SECTION_ORDER:
-        sections[section] = []
-    
-    # Categoría para URLs que no pertenecen a ninguna sección conocida
-    sections["other"] = []
-    
-    # Clasificar cada URL en su sección correspondiente
-    for url in urls:
-        found_section = False
-        for section in SECTION_ORDER:
-            if f"/{section}/" in url:
-                sections[section].append(url)
-                found_section = True
-                break
-        
-        if not found_section:
-            sections["other"].append(url)
-    
-    # Procesar subsecciones
-    for section, subsections in SUBSECTION_ORDER.items():
-        if section in sections and sections[section]:
-            # Ordenamos las URLs de esta sección por subsecciones
-            subsection_urls = {}
-            for subsection in subsections:
-                subsection_urls[subsection] = []
-            
-            # Categoría para URLs que están en la sección pero no en subsecciones conocidas
-            subsection_urls["other"] = []
-            
-            # Clasificar las URLs de esta sección en subsecciones
-            for url in sections[section]:
-                found_subsection = False
-                for subsection in subsections:
-                    if f"/{section}/{subsection}/" in url:
-                        subsection_urls[subsection].append(url)
-                        found_subsection = True
-                        break
-                
-                if not found_subsection:
-                    # Si no pertenece a ninguna subsección, puede ser un archivo directamente en la sección
-                    if url.split('/')[-2] == section:
-                        subsection_urls["other"].append(url)
-                    else:
-                        # O podría estar en una subsección no definida
-                        subsection_path = url.split(f"/{section}/")[1].split("/")[0]
-                        if subsection_path not in subsection_urls:
-                            subsection_urls[subsection_path] = []
-                        subsection_urls[subsection_path].append(url)
-            
-            # Reordenar la sección según las subsecciones
-            ordered_section_urls = []
-            for subsection in subsections:
-                # Para cada subsección, ordenar sus URLs según el orden específico de archivos si existe
-                subsection_files = subsection_urls[subsection]
-                if f"{section}/{subsection}" in SPECIFIC_FILE_ORDER:
-                    specific_order = SPECIFIC_FILE_ORDER[f"{section}/{subsection}"]
-                    # Primero colocamos los archivos con orden específico
-                    for file_name in specific_order:
-                        for url in subsection_files[:]:
-                            if url.endswith(f"/{file_name}"):
-                                ordered_section_urls.append(url)
-                                subsection_files.remove(url)
-                                break
-                    
-                    # Luego añadimos el resto de archivos de la subsección
-                    ordered_section_urls.extend(sorted(subsection_files))
-                else:
-                    # Si no hay orden específico, ordenamos alfabéticamente
-                    ordered_section_urls.extend(sorted(subsection_files))
-            
-            # Añadir URLs que están directamente en la sección (no en subsecciones)
-            if "other" in subsection_urls and subsection_urls["other"]:
-                # Verificar si hay un orden específico para estos archivos
-                if section in SPECIFIC_FILE_ORDER:
-                    specific_order = SPECIFIC_FILE_ORDER[section]
-                    other_files = subsection_urls["other"]
-                    
-                    # Ordenar según el orden específico
-                    for file_name in specific_order:
-                        for url in other_files[:]:
-                            if url.endswith(f"/{file_name}"):
-                                ordered_section_urls.append(url)
-                                other_files.remove(url)
-                                break
-                    
-                    # Añadir el resto de archivos que no tienen orden específico
-                    ordered_section_urls.extend(sorted(other_files))
-                else:
-                    # Sin orden específico, solo ordenamos alfabéticamente
-                    ordered_section_urls.extend(sorted(subsection_urls["other"]))
-            
-            # Reemplazar la lista original de la sección con la ordenada
-            sections[section] = ordered_section_urls
-        else:
-            # Si no hay URLs en esta sección o la sección no existe, continuamos
-            continue
+    if isinstance(jobs, list):
+        jobs = {"sites": jobs}
+    sites = [SiteConfig.from_job(entry, jobs.get("defaults")) for entry in jobs.get("sites") or []]
     
-    # Para las secciones sin subsecciones, ordenar según el orden específico de archivos
-    for section in SECTION_ORDER:
-        if section not in SUBSECTION_ORDER and section in SPECIFIC_FILE_ORDER and section in sections:
-            specific_order = SPECIFIC_FILE_ORDER[section]
-            section_urls = sections[section]
-            ordered_section_urls = []
-            
-            # Primero colocamos los archivos con orden específico
-            for file_name in specific_order:
-                for url in section_urls[:]:
-                    if url.endswith(f"/{file_name}"):
-                        ordered_section_urls.append(url)
-                        section_urls.remove(url)
-                        break
-            
-            # Luego añadimos el resto de archivos
-            ordered_section_urls.extend(sorted(section_urls))
-            sections[section] = ordered_section_urls
+    names = [site.name for site in sites]
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if repeated:
+        raise ValueError(f"Nombres de sitio repetidos en {path}: {', '.join(repeated)}")
+    return sites
+
+def build_site(site, fetch_pool=None, render_pool=None):
+    """
+    Genera el PDF de un sitio del modo batch: descubre y ordena sus URLs, las
+    convierte con los pools compartidos y combina el resultado.
+    Devuelve un resumen para el informe de la ejecución.
+    """
+    started = time.time()
+    os.makedirs(site.temp_dir, exist_ok=True)
+    # Todas las descargas del sitio (crawling, páginas y recursos) comparten el
+    # límite de conexiones de su host
+    fetch_executor = site.fetch_executor = fetch_pool.for_key(site.host) if fetch_pool else None
     
-    # Reconstruir la lista final de URLs en el orden correcto
-    ordered_urls = []
-    for section in SECTION_ORDER:
-        ordered_urls.extend(sections[section])
+    if PIPELINE_MODE:
+        # Crawling, procesamiento y renderizado a la vez, con los pools compartidos
+        with (render_pool.share(site.name) if render_pool else contextlib.nullcontext()) as render_executor:
+            urls, pdf_files = run_pipeline(site.seed_url, site=site, executor=render_executor)
+        if not urls:
+            logger.error(f"[{site.name}] No se encontraron URLs para procesar")
+            return {"merged": False, "pages": 0}
+    else:
+        with run_stats.measure("crawl", site.name):
+            crawled_urls = discover_urls(site.seed_url, site=site, executor=fetch_executor)
+        if not crawled_urls:
+            logger.error(f"[{site.name}] No se encontraron URLs para procesar")
+            return {"merged": False, "pages": 0}
+        
+        urls = order_document_urls(crawled_urls, site)
+        logger.info(f"[{site.name}] URLs ordenadas para procesar: {len(urls)}")
+        
+        with (render_pool.share(site.name) if render_pool else contextlib.nullcontext()) as render_executor:
+            if RENDER_MODE == "document":
+                pdf_files = convert_to_pdf_document(urls, site=site, executor=render_executor)
+            else:
+                pdf_files = convert_to_pdf(urls, site=site, executor=render_executor)
+    
+    if not PIPELINE_MODE and RENDER_MODE == "document" and len(pdf_files) == 1:
+        shutil.copyfile(pdf_files[0], site.output_pdf)
+        merged = True
+    elif MERGE_MODE == "stream":
+        merged = merge_pdfs_streaming(pdf_files, site.output_pdf)
+    else:
+        merged = merge_pdfs(pdf_files, site.output_pdf)
     
-    # Añadir URLs que no pertenecen a ninguna sección conocida
-    ordered_urls.extend(sorted(sections["other"]))
+    if merged:
+        logger.info(f"[{site.name}] 🎉 PDF generado exitosamente: {site.output_pdf}")
+        cleanup(pdf_files, site.temp_dir, clear_pages=False)
+    else:
+        logger.error(f"[{site.name}] ❌ No se pudo generar el PDF; se conservan los temporales en {site.temp_dir}")
     
-    return ordered_urls
+    return {
+        "merged": merged,
+        "pages": len(urls),
+        "duplicates": len(site.duplicates.duplicates),
+        "output_pdf": site.output_pdf if merged else None,
+        "output_bytes": os.path.getsize(site.output_pdf) if merged else 0,
+        "seconds": round(time.time() - started, 2),
+    }
+
+def run_batch(path, parallel=None):
+    """
+    Modo batch: genera el PDF de cada sitio del archivo de trabajos. Los sitios se
+    procesan a la vez (hasta `parallel`) y comparten un pool de descargas, con un
+    límite de conexiones por host, y un pool de renderizado repartido entre los
+    sitios activos. Devuelve {nombre del sitio: resumen}.
+    """
+    try:
+        sites = load_jobs(path)
+    except Exception as e:
+        logger.error(f"No se pudo leer el archivo de trabajos {path}: {str(e)}")
+        return {}
+    if not sites:
+        logger.error(f"No hay sitios en {path}")
+        return {}
+    
+    parallel = max(1, min(parallel or BATCH_PARALLEL_SITES, len(sites)))
+    logger.info(f"Modo batch: {len(sites)} sitios, {parallel} a la vez")
+    size_http_session(get_http_session(), parallel)
+    results = {}
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as fetch_executor, \
+            ThreadPoolExecutor(max_workers=RENDER_WORKERS) as render_executor, \
+            ThreadPoolExecutor(max_workers=parallel) as site_executor:
+        # Con 0, cada host puede usar todo el pool de descargas
+        fetch_pool = FairSharePool(fetch_executor, CRAWL_WORKERS, BATCH_HOST_CONNECTIONS or CRAWL_WORKERS)
+        render_pool = FairSharePool(render_executor, RENDER_WORKERS)
+        futures = {site.name: site_executor.submit(build_site, site, fetch_pool, render_pool) for site in sites}
+        
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"[{name}] Error al generar el PDF: {str(e)}")
+                results[name] = {"merged": False, "error": str(e)}
+    return results
+
+def parse_args():
+    """
+    Lee las opciones de línea de comandos que sobrescriben la configuración general.
+    """
+    parser = argparse.ArgumentParser(description="Genera un PDF a partir de una documentación HTML.")
+    parser.add_argument("--workers", type=int, default=CRAWL_WORKERS,
+                        help="Número de páginas descargadas en paralelo durante el crawling")
+    parser.add_argument("--rate-limit", type=float, default=CRAWL_RATE_LIMIT,
+                        help="Máximo de peticiones por segundo a un mismo host (0 = sin límite)")
+    parser.add_argument("--page-store-mb", type=int, default=None,
+                        help="Memoria máxima (MB) para guardar páginas descargadas antes de volcarlas a disco "
+                             f"(por defecto {PAGE_STORE_MEMORY_LIMIT // (1024 * 1024)}, o 0 con --low-memory)")
+    parser.add_argument("--no-http-cache", action="store_true",
+                        help="Desactiva la caché HTTP persistente entre ejecuciones")
+    parser.add_argument("--no-incremental", action="store_true",
+                        help="Renderiza todas las páginas aunque su contenido no haya cambiado")
+    parser.add_argument("--render-workers", type=int, default=RENDER_WORKERS,
+                        help="Número de procesos de renderizado ejecutados en paralelo")
+    parser.add_argument("--render-timeout", type=int, default=RENDER_TIMEOUT,
+                        help="Segundos máximos de renderizado por página")
+    parser.add_argument("--renderer", choices=list(RENDERERS), default=RENDER_BACKEND,
+                        help="Backend de renderizado: wkhtmltopdf o WeasyPrint en procesos permanentes")
+    parser.add_argument("--profile", choices=["auto"] + list(RENDER_PROFILES), default=RENDER_PROFILE,
+                        help="Perfil de renderizado (auto elige por página según scripts e imágenes)")
+    parser.add_argument("--parser", choices=["html.parser", "lxml"], default=PARSER_BACKEND,
+                        help="Analizador HTML usado para procesar las páginas")
+    parser.add_argument("--discovery", choices=["crawl", "sitemap", "nav", "auto"], default=DISCOVERY_MODE,
+                        help="Cómo obtener las URLs: crawling completo, sitemap.xml, menú de navegación o automático")
+    parser.add_argument("--sitemap", action="append", default=[],
+                        help="URL de un sitemap a leer (se puede repetir)")
+    parser.add_argument("--crawl-missing", action="store_true",
+                        help="Completar el sitemap o el menú con un crawling del sitio")
+    parser.add_argument("--max-depth", type=int, default=CRAWL_MAX_DEPTH,
+                        help="Profundidad máxima del crawling desde la página inicial (0 = sin límite)")
+    parser.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES,
+                        help="Número máximo de URLs a descubrir (0 = sin límite)")
+    parser.add_argument("--merge-mode", choices=["merger", "stream"], default=MERGE_MODE,
+                        help="Combinar al final con PdfMerger o escribir el PDF de forma incremental")
+    parser.add_argument("--no-merge-dedup", action="store_true",
+                        help="No compartir entre fragmentos las fuentes e imágenes idénticas al combinar")
+    parser.add_argument("--recompress", action="store_true",
+                        help="Recomprimir los streams del PDF combinado con el nivel máximo de zlib")
+    parser.add_argument("--optimize", metavar="PDF",
+                        help="Optimizar un PDF ya generado (recursos compartidos y compresión) y salir")
+    parser.add_argument("--batch", metavar="TRABAJOS",
+                        help="Generar los PDFs de todos los sitios de un archivo de trabajos YAML o JSON")
+    parser.add_argument("--batch-sites", type=int, default=BATCH_PARALLEL_SITES,
+                        help="Sitios que se procesan a la vez en modo batch")
+    parser.add_argument("--host-connections", type=int, default=BATCH_HOST_CONNECTIONS,
+                        help="Descargas simultáneas por host en modo batch (0 = sin límite)")
+    parser.add_argument("--render-mode", choices=["pages", "document"], default=RENDER_MODE,
+                        help="Renderizar cada página por separado o todo el sitio como un único documento")
+    parser.add_argument("--batch-size", type=int, default=RENDER_BATCH_SIZE,
+                        help="Páginas por lote en modo documento (0 = un único lote)")
+    parser.add_argument("--toc", action="store_true",
+                        help="Añadir un índice al principio en modo documento")
+    parser.add_argument("--retries", type=int, default=HTTP_RETRIES,
+                        help="Reintentos de cada petición HTTP ante errores de conexión, 429 y 5xx")
+    parser.add_argument("--backoff", type=float, default=HTTP_BACKOFF,
+                        help="Espera base en segundos entre reintentos (backoff exponencial con jitter)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Procesar y renderizar las páginas mientras continúa el crawling")
+    parser.add_argument("--no-asset-cache", action="store_true",
+                        help="Dejar que wkhtmltopdf descargue imágenes y hojas de estilo en cada página")
+    parser.add_argument("--no-inline-css", action="store_true",
+                        help="Referenciar las hojas de estilo locales en lugar de incrustarlas")
+    parser.add_argument("--duplicates", choices=["off", "skip", "collapse"], default=DUPLICATE_MODE,
+                        help="Qué hacer con las páginas casi duplicadas de otra")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Liberar los árboles en cuanto se usan y pasar el HTML a wkhtmltopdf por archivos temporales")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continuar una ejecución interrumpida a partir del diario")
+    parser.add_argument("--journal", default=JOURNAL_PATH,
+                        help="Ruta del diario de la ejecución (JSON Lines)")
+    parser.add_argument("--report", default=RUN_REPORT_PATH,
+                        help="Ruta del informe JSON con los tiempos por etapa (vacío para desactivarlo)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    logger.info("🚀 Iniciando scraping de documentación API")
+    args = parse_args()
+    CRAWL_WORKERS = args.workers
+    CRAWL_RATE_LIMIT = args.rate_limit
+    CRAWL_MAX_DEPTH = args.max_depth
+    CRAWL_MAX_PAGES = args.max_pages
+    DISCOVERY_MODE = args.discovery
+    SITEMAP_URLS = args.sitemap or SITEMAP_URLS
+    DISCOVERY_CRAWL_MISSING = args.crawl_missing
+    HTTP_CACHE_ENABLED = not args.no_http_cache
+    INCREMENTAL_RENDER = not args.no_incremental
+    RENDER_WORKERS = args.render_workers
+    RENDER_TIMEOUT = args.render_timeout
+    PARSER_BACKEND = args.parser
+    RENDER_PROFILE = args.profile
+    RENDER_BACKEND = args.renderer
+    MERGE_MODE = args.merge_mode
+    RENDER_MODE = args.render_mode
+    RENDER_BATCH_SIZE = args.batch_size
+    RENDER_TOC = args.toc
+    RUN_REPORT_PATH = args.report
+    PIPELINE_MODE = args.pipeline
+    HTTP_RETRIES = args.retries
+    RESUME = args.resume
+    MEMORY_BOUNDED = args.low_memory
+    if args.page_store_mb is not None:
+        page_store.memory_limit = args.page_store_mb * 1024 * 1024
+    elif MEMORY_BOUNDED:
+        # En modo de memoria acotada las páginas descargadas van directamente a disco
+        page_store.memory_limit = 0
+    DUPLICATE_MODE = args.duplicates
+    ASSET_CACHE_ENABLED = not args.no_asset_cache
+    INLINE_STYLESHEETS = not args.no_inline_css
+    JOURNAL_PATH = args.journal
+    HTTP_BACKOFF = args.backoff
+    MERGE_DEDUP = not args.no_merge_dedup
+    MERGE_RECOMPRESS = args.recompress
+    
+    BATCH_PARALLEL_SITES = args.batch_sites
+    BATCH_HOST_CONNECTIONS = args.host_connections
     
-    # 1. Obtenemos todas las URLs mediante crawling
-    crawled_urls = extract_urls_by_crawling(SEED_URL)
+    if args.optimize:
+        sys.exit(0 if optimize_pdf(args.optimize) else 1)
     
-    if not crawled_urls:
-        logger.error("No se encontraron URLs para procesar")
-        exit(1)
+    if RENDER_BACKEND == "weasyprint" and load_weasyprint() is None:
+        logger.error("WeasyPrint no está disponible (pip install weasyprint y las bibliotecas de Pango)")
+        sys.exit(1)
+    
+    if args.batch:
+        if RESUME:
+            logger.warning("El modo batch no admite --resume; se ignora")
+        if PIPELINE_MODE and RENDER_MODE == "document":
+            logger.warning("El modo pipeline renderiza página a página; se ignora --render-mode document")
+        run_journal.path = JOURNAL_PATH
+        run_journal.reset()
+        
+        results = run_batch(args.batch)
+        close_renderer()
+        built = [name for name, result in results.items() if result.get("merged")]
+        logger.info(f"Modo batch: {len(built)}/{len(results)} PDFs generados")
+        for name, result in results.items():
+            if not result.get("merged"):
+                logger.error(f"❌ Sin PDF: {name}")
+        
+        if results and len(built) == len(results):
+            if INCREMENTAL_RENDER:
+                render_cache.prune()
+            if ASSET_CACHE_ENABLED:
+                asset_cache.prune()
+            run_journal.reset()
+        if HTTP_CACHE_ENABLED:
+            http_cache.log_stats()
+        page_store.clear()
+        
+        if RUN_REPORT_PATH:
+            run_stats.write_report(RUN_REPORT_PATH, renderer=RENDER_BACKEND, render_profile=RENDER_PROFILE, sites=results)
+        sys.exit(0 if results and len(built) == len(results) else 1)
     
-    logger.info(f"Se encontraron {len(crawled_urls)} URLs mediante crawling")
+    logger.info("🚀 Iniciando scraping de documentación API")
     
-    # 2. Ordenamos las URLs según la estructura definida
-    urls = order_urls_by_structure(crawled_urls)
+    run_journal.path = JOURNAL_PATH
+    if RESUME:
+        run_journal.load()
+        logger.info(f"Reanudando la ejecución anterior: {len(run_journal.pages)} PDFs ya generados"
+                    + (f", {len(run_journal.urls)} URLs ya ordenadas" if run_journal.urls else ""))
+    else:
+        run_journal.reset()
     
-    # 3. Verificamos si tenemos URLs de referencia que deben ir al principio
-    if REFERENCE_ORDER:
-        # Si hay referencias manuales, aseguramos que estén al principio
-        reference_urls = [url for url in REFERENCE_ORDER if url in crawled_urls]
-        other_urls = [url for url in urls if url not in reference_urls]
-        urls = reference_urls + other_urls
+    if PIPELINE_MODE:
+        # Crawling, procesamiento y renderizado a la vez; el orden se aplica al combinar
+        if RENDER_MODE == "document":
+            logger.warning("El modo pipeline renderiza página a página; se ignora --render-mode document")
+        urls, pdf_files = run_pipeline(SEED_URL)
+        if not urls:
+            logger.error("No se encontraron URLs para procesar")
+            exit(1)
+        
+        logger.info(f"URLs procesadas: {len(urls)}")
+        if MERGE_MODE == "stream":
+            merged = merge_pdfs_streaming(pdf_files, OUTPUT_PDF)
+        else:
+            merged = merge_pdfs(pdf_files, OUTPUT_PDF)
+    else:
+        if run_journal.urls:
+            # Reanudación: el crawling y el orden ya están en el diario
+            urls = run_journal.urls
+        else:
+            # 1. Obtenemos todas las URLs mediante crawling
+            with run_stats.measure("crawl"):
+                crawled_urls = discover_urls(SEED_URL)
+            
+            if not crawled_urls:
+                logger.error("No se encontraron URLs para procesar")
+                exit(1)
+            
+            logger.info(f"Se encontraron {len(crawled_urls)} URLs")
+            
+            # 2. Ordenamos las URLs según la estructura definida y las referencias manuales
+            urls = order_document_urls(crawled_urls)
+            run_journal.record_urls(crawled_urls, urls)
+        
+        logger.info(f"URLs ordenadas para procesar: {len(urls)}")
+        for i, url in enumerate(urls, 1):
+            logger.info(f"{i}. {url}")
+        
+        # 3. Convertir a PDF y combinar
+        if RENDER_MODE == "document":
+            pdf_files = convert_to_pdf_document(urls)
+            if len(pdf_files) == 1:
+                # Un único lote: el PDF ya es el documento final, no hace falta combinar
+                shutil.copyfile(pdf_files[0], OUTPUT_PDF)
+                merged = True
+            elif MERGE_MODE == "stream":
+                merged = merge_pdfs_streaming(pdf_files, OUTPUT_PDF)
+            else:
+                merged = merge_pdfs(pdf_files, OUTPUT_PDF)
+        elif MERGE_MODE == "stream":
+            # Cada página se añade al PDF final en cuanto están listas las anteriores
+            assembler = OrderedPdfAssembler(StreamingPdfWriter(OUTPUT_PDF))
+            pdf_files = convert_to_pdf(urls, on_page_ready=assembler.add)
+            merged = assembler.close()
+        else:
+            pdf_files = convert_to_pdf(urls)
+            merged = merge_pdfs(pdf_files, OUTPUT_PDF)
     
-    logger.info(f"URLs ordenadas para procesar: {len(urls)}")
-    for i, url in enumerate(urls, 1):
-        logger.info(f"{i}. {url}")
+    # Los procesos del renderizador terminan antes de medir la memoria de los hijos
+    close_renderer()
+    memory = peak_rss()
+    if memory:
+        logger.info(f"Memoria máxima: {memory['self_mb']} MB ({RENDER_BACKEND}: {memory['children_mb']} MB)")
     
-    # Convertir a PDF
-    pdf_files = convert_to_pdf(urls)
+    if duplicate_detector.duplicates:
+        action = "omitidas" if DUPLICATE_MODE == "skip" else "reducidas a una nota"
+        logger.info(f"Páginas casi duplicadas {action}: {len(duplicate_detector.duplicates)}")
     
-    # Combinar PDFs
-    if merge_pdfs(pdf_files, OUTPUT_PDF):
+    if merged:
         logger.info(f"🎉 PDF generado exitosamente: {OUTPUT_PDF}")
+        if INCREMENTAL_RENDER:
+            render_cache.prune()
+        if ASSET_CACHE_ENABLED:
+            asset_cache.prune()
     else:
         logger.error("❌ No se pudo generar el PDF final")
     
-    # Limpieza
-    cleanup(pdf_files, TEMP_DIR)
+    if HTTP_CACHE_ENABLED:
+        http_cache.log_stats()
+    
+    # Limpieza; si la ejecución falla se conservan los PDFs para poder reanudarla
+    if merged:
+        cleanup(pdf_files, TEMP_DIR)
+        run_journal.reset()
+    else:
+        page_store.clear()
+        logger.info("Se conservan los PDFs temporales; puede continuarse con --resume")
+    
+    if RUN_REPORT_PATH:
+        run_stats.write_report(
+            RUN_REPORT_PATH,
+            pages=len(urls),
+            renderer=RENDER_BACKEND,
+            render_profile=RENDER_PROFILE,
+            duplicates=duplicate_detector.duplicates,
+            output_pdf=OUTPUT_PDF if merged else None,
+            output_bytes=os.path.getsize(OUTPUT_PDF) if merged else 0,
+        )